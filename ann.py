@@ -0,0 +1,85 @@
+import hashlib
+import os
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # без hnswlib predict_cross остаётся на точном скане
+    hnswlib = None
+
+# HNSW-индекс над skipgram-эмбеддингами для cross-domain поиска.
+# Пространство 'ip': ранжирование совпадает с точным proj @ tgt_embs.T.
+
+
+class HnswSearcher:
+    def __init__(self, index, ef=64):
+        self.index = index
+        self.set_ef(ef)
+
+    def set_ef(self, ef):
+        self.ef = ef
+        self.index.set_ef(ef)
+
+    def knn(self, queries, k):
+        """(индексы, скоры) по строкам запросов, лучшие первыми; скор = скалярное произведение."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, self.index.get_current_count())
+        if self.ef < k:
+            self.set_ef(k)
+        labels, dist = self.index.knn_query(queries, k=k)
+        return labels.astype(np.int64), 1.0 - dist
+
+
+def hnsw_path(out_dir, name):
+    return os.path.join(out_dir, f'{name}_embeddings.hnsw')
+
+
+def fingerprint(embs):
+    """Хэш содержимого эмбеддингов: индекс, построенный по другим векторам того же размера, не годится."""
+    embs = np.ascontiguousarray(embs, dtype=np.float32)
+    return hashlib.blake2b(memoryview(embs).cast('B'), digest_size=16).hexdigest() + f':{embs.shape}'
+
+
+def _fingerprint_path(path):
+    return f'{path}.fingerprint'
+
+
+def build_hnsw_index(embs, path=None, M=16, ef_construction=200):
+    if hnswlib is None:
+        return None
+    index = hnswlib.Index(space='ip', dim=embs.shape[1])
+    index.init_index(max_elements=len(embs), M=M, ef_construction=ef_construction)
+    index.add_items(np.asarray(embs, dtype=np.float32), np.arange(len(embs)))
+    if path is not None:
+        # читатель сверяет отпечаток и читает индекс: старый отпечаток убираем до подмены файла,
+        # новый пишем после — совпавший отпечаток всегда значит целиком записанный индекс
+        if os.path.isfile(_fingerprint_path(path)):
+            os.remove(_fingerprint_path(path))
+        tmp = f'{path}.{os.getpid()}.tmp'
+        index.save_index(tmp)
+        os.replace(tmp, path)
+        with open(f'{tmp}.fingerprint', 'w') as f:
+            f.write(fingerprint(embs))
+        os.replace(f'{tmp}.fingerprint', _fingerprint_path(path))
+    return index
+
+
+def load_hnsw_index(path, embs, ef=64, build_missing=False):
+    """
+    Поднимает индекс с диска; None, если файла нет или он от других эмбеддингов.
+    Строится при обучении (app.train) и при публикации снапшота; build_missing=True — построить тут же.
+    """
+    if hnswlib is None:
+        return None
+    index = None
+    if os.path.isfile(path) and os.path.isfile(_fingerprint_path(path)):
+        with open(_fingerprint_path(path)) as f:
+            same = f.read().strip() == fingerprint(embs)
+        if same:
+            index = hnswlib.Index(space='ip', dim=embs.shape[1])
+            index.load_index(path, max_elements=len(embs))
+    if index is None:
+        if not build_missing:
+            return None
+        index = build_hnsw_index(embs, path)
+    return HnswSearcher(index, ef)
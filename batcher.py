@@ -0,0 +1,59 @@
+import asyncio
+
+# Склейка конкурентных /recommend в один батч: вместо сотни матрично-векторных
+# произведений — одно матрично-матричное (см. get_batch_recommendations).
+# Запросы копятся до max_batch пользователей или max_wait секунд, что наступит раньше.
+
+
+class MicroBatcher:
+    def __init__(self, score_batch, max_batch=64, max_wait=0.002, executor=None):
+        self.score_batch = score_batch  # (group, [user_id, ...]) -> {user_id: результат}
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.executor = executor
+        self._pending = {}  # group -> [(user_id, future), ...]
+        self._timers = {}
+        self.batches = 0
+        self.requests = 0
+
+    async def submit(self, group, user_id):
+        """group — всё, что должно совпадать у склеиваемых запросов (лоадер, домен, top_k)."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        pending = self._pending.setdefault(group, [])
+        pending.append((user_id, fut))
+        if len(pending) >= self.max_batch:
+            self._flush(group)
+        elif len(pending) == 1:
+            self._timers[group] = loop.call_later(self.max_wait, self._flush, group)
+        return await fut
+
+    def _flush(self, group):
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(group, None)
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(group, batch))
+
+    async def _run(self, group, batch):
+        self.batches += 1
+        self.requests += len(batch)
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self.executor, self.score_batch, group, [u for u, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for user_id, fut in batch:
+            if not fut.done():  # клиент мог отвалиться, пока батч считался
+                fut.set_result(result[user_id])
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch": self.requests / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,620 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from app.interactions import InteractionIndex
+from app.scoring import CollabScorer, ContentScorer, CrossTable, DenseTranslator, select_top_k
+
+# Микробенчмарки сервинга на синтетических данных.
+# Запуск: python -m app.benchmarks <name> [<name> ...]
+
+
+def _timeit(fn, repeat=200):
+    """Медиана времени вызова fn в микросекундах."""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)) * 1e6
+
+
+def synthetic_ratings(n_ratings, n_users, n_items, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'user_id': rng.integers(0, n_users, n_ratings),
+        'book_id': rng.integers(0, n_items, n_ratings),
+        'rating': rng.integers(1, 11, n_ratings),
+    })
+
+
+class DenseModel:
+    """Линейная модель на NumPy вместо Keras — чтобы гонять сервинг без обученных весов."""
+    def __init__(self, w):
+        self.w = w
+
+    def __call__(self, x):
+        return np.asarray(x, dtype=np.float32) @ self.w
+
+    def predict(self, x, verbose=0):
+        return self(x)
+
+
+def synthetic_loader(n_ratings=200_000, n_users=5_000, n_items=20_000, dim=64, n_genres=20, seed=0):
+    """Лоадер со случайными весами: домен книг целиком и эмбеддинги фильмов для cross."""
+    rng = np.random.default_rng(seed)
+    df = synthetic_ratings(n_ratings, n_users, n_items, seed)
+    u2b = {u: i for i, u in enumerate(df.user_id.unique())}
+    b2idx = {b: i for i, b in enumerate(df.book_id.unique())}
+    n_books, n_movies = len(b2idx), n_items
+    b_mat = (rng.random((n_books, n_genres)) < 0.1).astype(np.float32)
+    return SimpleNamespace(
+        u2b=u2b, b2idx=b2idx,
+        idx2b=np.array(list(b2idx)), idx2m=np.arange(n_movies),
+        br_index=InteractionIndex.from_ratings(df, u2b, b2idx, 'book_id'),
+        scorers={'collab_book': CollabScorer(rng.normal(size=(len(u2b), dim)).astype(np.float32),
+                                             rng.normal(size=(n_books, dim)).astype(np.float32)),
+                 'book2movie': DenseModel(rng.normal(size=(dim, dim)).astype(np.float32)),
+                 'content_book': ContentScorer.from_predictions(b_mat, rng.normal(size=n_books))},
+        models={}, ann={}, ivf={}, cross={},
+        b_mat=b_mat,
+        book_embs=rng.normal(size=(n_books, dim)).astype(np.float32),
+        movie_embs=rng.normal(size=(n_movies, dim)).astype(np.float32),
+    )
+
+
+def synthetic_snapshot(out_dir, **kwargs):
+    """
+    synthetic_loader, сохранённый снапшотом в <out_dir>/serving — чтобы поднять настоящий сервис
+    (uvicorn с cwd=<каталог над out_dir>) без обученных моделей. Фильмы — только как цель cross.
+    HNSW-индексы строятся тут же, как при публикации после обучения, — в холодный старт они не входят.
+    """
+    from app.loader import ModelLoader
+
+    src = synthetic_loader(**kwargs)
+    rng = np.random.default_rng(1)
+    dim = src.book_embs.shape[1]
+    loader = ModelLoader(data_dir=os.path.join(os.path.dirname(out_dir), 'data'), out_dir=out_dir)
+    loader.__dict__.update(vars(src))
+    for key in ('book2movie', 'movie2book'):
+        loader.scorers[key] = DenseTranslator(
+            (rng.normal(size=(dim, dim)) / np.sqrt(dim)).astype(np.float32), np.zeros(dim, np.float32),
+            (rng.normal(size=(dim, dim)) / np.sqrt(dim)).astype(np.float32), np.zeros(dim, np.float32))
+    n_genres = src.b_mat.shape[1]
+    loader.idx2ub, loader.idx2um = np.array(list(src.u2b)), np.zeros(0, dtype=np.int64)
+    loader.u2m = {}
+    loader.m_mat = np.zeros((len(src.idx2m), n_genres), dtype=np.float32)
+    loader.b_genres = loader.m_genres = np.array([f'g{i}' for i in range(n_genres)])
+    loader.mr_index = InteractionIndex(np.zeros(1, np.int64), np.zeros(0, np.int32), np.zeros(0, np.float32))
+    loader.version = 'bench'
+    loader._build_cross_tables()
+    os.makedirs(out_dir, exist_ok=True)  # hnswlib молча не пишет в несуществующий каталог
+    loader._load_ann(build_missing=True)
+    loader.save_snapshot()
+    return loader
+
+
+def _serve(workdir, port, env=None, workers=1):
+    """uvicorn app.main:app в отдельном процессе; cwd=workdir, чтобы outputs/ и data/ были там."""
+    import subprocess
+    import app
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(app.__file__)))
+    env = {**os.environ, 'PYTHONPATH': root, **(env or {})}
+    return subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port),
+                             '--workers', str(workers)],
+                            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _post(conn, path, payload):
+    import json
+    conn.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+    resp = conn.getresponse()
+    body = resp.read()
+    if resp.status != 200:
+        raise RuntimeError(f'{path}: {resp.status} {body[:200]!r}')
+    return json.loads(body)
+
+
+def _wait_ready(port, timeout=120):
+    import http.client
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', '/stats')
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status == 200:
+                return conn
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f'service on :{port} did not start')
+
+
+def bench_endpoint(n_requests=500, port=8766):
+    """
+    p50/p99 POST /recommend/books через HTTP к живому uvicorn на синтетическом снапшоте:
+    источники последовательно против пула потоков; каждый запрос — новый пользователь, мимо кэша.
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as workdir:
+        loader = synthetic_snapshot(os.path.join(workdir, 'outputs'))
+        users = loader.idx2ub.tolist()
+        print(f"{'mode':>12} {'p50, ms':>10} {'p99, ms':>10}")
+        for name, env in [('sequential', {'RECS_PARALLEL_SOURCES': '0'}), ('threads', {'RECS_PARALLEL_SOURCES': '1'})]:
+            proc = _serve(workdir, port, env)
+            try:
+                conn = _wait_ready(port)
+                for u in users[-20:]:  # прогрев
+                    _post(conn, '/recommend/books', {'user_id': u})
+                times = []
+                for u in users[:n_requests]:
+                    t0 = time.perf_counter()
+                    _post(conn, '/recommend/books', {'user_id': u})
+                    times.append(time.perf_counter() - t0)
+                p50, p99 = _percentiles(times)
+                print(f"{name:>12} {p50:>10.2f} {p99:>10.2f}")
+            finally:
+                proc.terminate()
+                proc.wait()
+
+
+def bench_batch_endpoint(port=8767, batch_sizes=(16, 128, 1024)):
+    """Пользователей в секунду через HTTP: цикл POST /recommend/books против одного /recommend/books/batch."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as workdir:
+        users = synthetic_snapshot(os.path.join(workdir, 'outputs')).idx2ub.tolist()
+        # кэш выключен: одни и те же пользователи идут в нескольких размерах батча
+        proc = _serve(workdir, port, {'RECS_CACHE_MB': '0'})
+        try:
+            conn = _wait_ready(port)
+            print(f"{'batch':>8} {'single, users/s':>16} {'batch, users/s':>16}")
+            for b in batch_sizes:
+                ids = users[:b]
+                t0 = time.perf_counter()
+                for u in ids:
+                    _post(conn, '/recommend/books', {'user_id': u})
+                single = b / (time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                _post(conn, '/recommend/books/batch', {'user_ids': ids})
+                batch = b / (time.perf_counter() - t0)
+                print(f"{b:>8} {single:>16.0f} {batch:>16.0f}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def bench_interactions(sizes=(100_000, 1_000_000, 10_000_000)):
+    """История пользователя: скан DataFrame против среза CSR-индекса."""
+    print(f"{'ratings':>12} {'df scan, us':>14} {'csr slice, us':>14}")
+    for n in sizes:
+        df = synthetic_ratings(n, n_users=max(n // 50, 1), n_items=50_000)
+        u2i = {u: i for i, u in enumerate(df.user_id.unique())}
+        b2i = {b: i for i, b in enumerate(df.book_id.unique())}
+        index = InteractionIndex.from_ratings(df, u2i, b2i, 'book_id')
+        user = int(df.user_id.iloc[0])
+        scan = _timeit(lambda: df[df.user_id == user].book_id.map(b2i).tolist(), repeat=20)
+        csr = _timeit(lambda: index.items_of(u2i[user]))
+        print(f"{n:>12} {scan:>14.1f} {csr:>14.2f}")
+
+
+def bench_topk(sizes=(10_000, 100_000, 1_000_000), k=10):
+    """Полная сортировка argsort против argpartition + сортировки победителей."""
+    print(f"{'items':>12} {'argsort, us':>14} {'argpartition, us':>17}")
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        scores = rng.normal(size=n).astype(np.float32)
+        full = _timeit(lambda: np.argsort(scores)[-k:][::-1], repeat=50)
+        part = _timeit(lambda: select_top_k(scores, k), repeat=50)
+        print(f"{n:>12} {full:>14.1f} {part:>17.1f}")
+
+
+def bench_batch(batch_sizes=(16, 128, 1024)):
+    """Пользователей в секунду: цикл по get_all_recommendations против одного батча."""
+    from app.recommender import get_all_recommendations, get_batch_recommendations
+
+    loader = synthetic_loader()
+    users = np.array(list(loader.u2b))
+    print(f"{'batch':>8} {'single, users/s':>16} {'batch, users/s':>16}")
+    for b in batch_sizes:
+        ids = users[:b].tolist()
+        t0 = time.perf_counter()
+        for u in ids:
+            get_all_recommendations(loader, u, 'books')
+        single = b / (time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        get_batch_recommendations(loader, ids, 'books')
+        batch = b / (time.perf_counter() - t0)
+        print(f"{b:>8} {single:>16.0f} {batch:>16.0f}")
+
+
+def _percentiles(times):
+    ms = np.array(times) * 1e3
+    return np.percentile(ms, 50), np.percentile(ms, 99)
+
+
+def bench_sources(n_requests=300, threads=8):
+    """p50/p99 одного запроса: источники последовательно, в пуле потоков и через async-вариант."""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from app.recommender import get_all_recommendations, get_all_recommendations_async
+
+    loader = synthetic_loader()
+    users = list(loader.u2b)[:n_requests]
+    executor = ThreadPoolExecutor(max_workers=threads)
+
+    def run_sync(pool):
+        times = []
+        for u in users:
+            t0 = time.perf_counter()
+            get_all_recommendations(loader, u, 'books', executor=pool)
+            times.append(time.perf_counter() - t0)
+        return times
+
+    async def run_async():
+        times = []
+        for u in users:
+            t0 = time.perf_counter()
+            await get_all_recommendations_async(loader, u, 'books', executor=executor)
+            times.append(time.perf_counter() - t0)
+        return times
+
+    print(f"{'mode':>12} {'p50, ms':>10} {'p99, ms':>10}")
+    for name, times in [('sequential', run_sync(None)), ('threads', run_sync(executor)),
+                        ('async', asyncio.run(run_async()))]:
+        p50, p99 = _percentiles(times)
+        print(f"{name:>12} {p50:>10.2f} {p99:>10.2f}")
+    executor.shutdown()
+
+
+def bench_microbatch(n_requests=2000, concurrency=(1, 8, 64, 256), threads=8):
+    """Пропускная способность и p99 при N одновременных клиентах: по запросу на пользователя против MicroBatcher."""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from app.batcher import MicroBatcher
+    from app.recommender import get_all_recommendations, get_batch_recommendations
+
+    loader = synthetic_loader()
+    users = list(loader.u2b)
+    executor = ThreadPoolExecutor(max_workers=threads)
+
+    async def single(u):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, get_all_recommendations, loader, u, 'books')
+
+    async def drive(call, clients):
+        times = []
+
+        async def client(offset):
+            for i in range(offset, n_requests, clients):
+                t0 = time.perf_counter()
+                await call(users[i % len(users)])
+                times.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client(c) for c in range(clients)))
+        return n_requests / (time.perf_counter() - t0), times
+
+    async def run(clients):
+        batcher = MicroBatcher(lambda group, ids: get_batch_recommendations(loader, ids, 'books'),
+                               executor=executor)
+        rows = []
+        for name, call in [('single', single), ('microbatch', lambda u: batcher.submit('books', u))]:
+            rps, times = await drive(call, clients)
+            rows.append((name, rps, *_percentiles(times)))
+        return rows, batcher.stats()['avg_batch']
+
+    print(f"{'clients':>8} {'mode':>11} {'req/s':>9} {'p50, ms':>9} {'p99, ms':>9} {'avg batch':>10}")
+    for clients in concurrency:
+        rows, avg_batch = asyncio.run(run(clients))
+        for name, rps, p50, p99 in rows:
+            extra = f"{avg_batch:>10.1f}" if name == 'microbatch' else ''
+            print(f"{clients:>8} {name:>11} {rps:>9.0f} {p50:>9.2f} {p99:>9.2f} {extra}")
+    executor.shutdown()
+
+
+def bench_cross(n_users=300, k=10):
+    """Cross-domain: переводчик на каждый запрос против предпосчитанной таблицы; overlap@k — совпадение выдач."""
+    from app.recommender import domain_view, get_interacted, get_ratings, predict_cross
+
+    loader = synthetic_loader()
+    rng = np.random.default_rng(1)
+    dim = loader.book_embs.shape[1]
+    translator = DenseTranslator(*(rng.normal(scale=dim ** -0.5, size=s).astype(np.float32)
+                                   for s in [(dim, dim), (dim,), (dim, dim), (dim,)]))
+    loader.scorers['book2movie'] = translator
+    t0 = time.perf_counter()
+    table = CrossTable.build(translator, loader.book_embs, loader.movie_embs)
+    build_ms = (time.perf_counter() - t0) * 1e3
+    d = domain_view(loader, 'books')
+
+    users = list(loader.u2b)[:n_users]
+    hist = [(get_interacted(d.index, d.user2idx, u), get_ratings(d.index, d.user2idx, u)) for u in users]
+    runs = {
+        'translate': lambda s, w: predict_cross(d.src_embs, d.tgt_embs, translator, s, d.idx2tgt, k),
+        'table': lambda s, w: predict_cross(d.src_embs, d.tgt_embs, translator, s, d.idx2tgt, k, table=table, weights=w),
+    }
+    print(f"table build: {build_ms:.0f} ms for {len(loader.book_embs)} items")
+    print(f"{'mode':>10} {'us/query':>10}")
+    tops = {}
+    for name, fn in runs.items():
+        tops[name] = [[r.item_id for r in fn(s, w)] for s, w in hist]
+        us = np.median([_timeit(lambda: fn(s, w), repeat=5) for s, w in hist[:50]])
+        print(f"{name:>10} {us:>10.0f}")
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(tops['translate'], tops['table'])])
+    print(f"overlap@{k} translate vs table: {overlap:.3f}")
+
+
+def _peak_rss_mb():
+    # VmHWM, а не ru_maxrss: тот переживает exec и в spawn-процессе показывает пик родителя
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmHWM')) / 1024
+
+
+def _columnar_worker(data_dir, mode, results):
+    from app.columnar import read_frame
+    from app.preprocess import COLUMNS, normalize_ratings
+
+    base = _peak_rss_mb()
+    t0 = time.perf_counter()
+    if mode == 'csv':
+        df = pd.read_csv(f'{data_dir}/book_ratings.csv')
+    else:
+        df = read_frame(data_dir, 'book_ratings', COLUMNS['book_ratings'])
+    df = normalize_ratings(df)
+    t_read = time.perf_counter() - t0
+    u2b = {u: i for i, u in enumerate(df.user_id.unique())}
+    b2idx = {b: i for i, b in enumerate(df.book_id.unique())}
+    InteractionIndex.from_ratings(df, u2b, b2idx, 'book_id')
+    t_index = time.perf_counter() - t0
+    peak = _peak_rss_mb() - base
+    results.put((mode, t_read, t_index, peak))
+
+
+def bench_columnar(n_ratings=10_000_000, n_users=200_000, n_items=300_000):
+    """Загрузка book_ratings: pd.read_csv против колоночного снапшота (mmap + только нужные колонки)."""
+    import multiprocessing as mp
+    import tempfile
+    from app.columnar import write_dataset
+
+    rng = np.random.default_rng(0)
+    df = synthetic_ratings(n_ratings, n_users, n_items)
+    ts = np.datetime64('2024-01-01') + rng.integers(0, 365 * 86400, n_ratings).astype('timedelta64[s]')
+    df['timestamp'] = ts.astype(str)
+    df['comment'] = rng.choice(['', 'great', 'so-so', 'meh'], n_ratings)  # колонка, которую load_all не читает
+    ctx = mp.get_context('spawn')
+    with tempfile.TemporaryDirectory() as data_dir:
+        df.to_csv(f'{data_dir}/book_ratings.csv', index=False)
+        write_dataset(data_dir, {'book_ratings': df})
+        del df
+        csv_mb = os.path.getsize(f'{data_dir}/book_ratings.csv') / 2**20
+        print(f"{n_ratings} ratings, csv: {csv_mb:.0f} MB")
+        print(f"{'mode':>9} {'read, s':>8} {'+index, s':>10} {'peak MB':>8}")
+        for mode in ('csv', 'columnar'):
+            results = ctx.Queue()
+            p = ctx.Process(target=_columnar_worker, args=(data_dir, mode, results))
+            p.start()
+            _, t_read, t_index, peak = results.get()
+            p.join()
+            print(f"{mode:>9} {t_read:>8.2f} {t_index:>10.2f} {peak:>8.0f}")
+
+
+def _mmap_worker(root, mmap, barrier, results):
+    from app.snapshot import memory_usage, read_snapshot
+
+    _, arrays = read_snapshot(root, mmap=mmap)
+    sum(float(a.sum()) for a in arrays.values())  # трогаем все страницы
+    barrier.wait()  # все воркеры живы одновременно — иначе PSS не покажет разделение
+    results.put(memory_usage())
+    barrier.wait()
+
+
+def bench_mmap(workers=4, n_items=500_000, dim=64):
+    """RSS/PSS на воркер: приватные копии массивов против общего mmap-снапшота."""
+    import multiprocessing as mp
+    import tempfile
+    from app.snapshot import write_snapshot
+
+    rng = np.random.default_rng(0)
+    arrays = {name: rng.normal(size=(n_items, dim)).astype(np.float32)
+              for name in ('book_embs', 'movie_embs', 'collab_book_items')}
+    size_mb = sum(a.nbytes for a in arrays.values()) / 2**20
+    with tempfile.TemporaryDirectory() as root:
+        write_snapshot(root, 'bench', arrays)
+        del arrays
+        print(f"snapshot: {size_mb:.0f} MB, workers: {workers}")
+        print(f"{'mode':>8} {'rss, MB':>10} {'pss, MB':>10}")
+        for mmap in (False, True):
+            barrier, results = mp.Barrier(workers), mp.Queue()
+            procs = [mp.Process(target=_mmap_worker, args=(root, mmap, barrier, results)) for _ in range(workers)]
+            for p in procs:
+                p.start()
+            usage = [results.get() for _ in procs]
+            for p in procs:
+                p.join()
+            rss = np.mean([u.get('vmrss', 0) for u in usage]) / 2**20
+            pss = np.mean([u.get('pss', 0) for u in usage]) / 2**20
+            print(f"{'mmap' if mmap else 'copy':>8} {rss:>10.0f} {pss:>10.0f}")
+
+
+def bench_startup(workdir=None, user_id=None, domain='books', port=8765, timeout=300):
+    """
+    Холодный старт: от запуска uvicorn до первого успешного /recommend.
+    workdir — каталог с outputs/serving; без него берётся синтетический снапшот.
+    """
+    import json
+    import tempfile
+    import urllib.error
+    import urllib.request
+
+    tmp = None
+    if workdir is None:
+        tmp = tempfile.TemporaryDirectory()
+        workdir = tmp.name
+        loader = synthetic_snapshot(os.path.join(workdir, 'outputs'))
+        user_id = loader.idx2ub[0].item() if user_id is None else user_id
+    url = f'http://127.0.0.1:{port}'
+    body = json.dumps({'user_id': 1 if user_id is None else user_id}).encode()
+    t0 = time.perf_counter()
+    proc = _serve(workdir, port)
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                req = urllib.request.Request(f'{url}/recommend/{domain}', data=body,
+                                             headers={'Content-Type': 'application/json'})
+                with urllib.request.urlopen(req) as resp:
+                    if resp.status == 200:
+                        break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+        first = time.perf_counter() - t0
+        with urllib.request.urlopen(f'{url}/stats') as resp:
+            startup = json.load(resp)['startup']
+        print(f"first /recommend after {first:.2f} s (server-side: {startup})")
+    finally:
+        proc.terminate()
+        proc.wait()
+        if tmp is not None:
+            tmp.cleanup()
+
+
+def bench_hnsw(n_items=200_000, dim=64, k=10, n_queries=500, efs=(16, 32, 64, 128, 256)):
+    """recall@k и латентность HNSW при разных ef против точного скана proj @ tgt_embs.T."""
+    from app.ann import HnswSearcher, build_hnsw_index
+
+    rng = np.random.default_rng(0)
+    embs = rng.normal(size=(n_items, dim)).astype(np.float32)
+    queries = rng.normal(size=(n_queries, dim)).astype(np.float32)
+    t0 = time.perf_counter()
+    searcher = HnswSearcher(build_hnsw_index(embs))
+    print(f"build: {time.perf_counter() - t0:.1f} s for {n_items} items")
+
+    exact, t_exact = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        exact.append(select_top_k(q @ embs.T, k)[0])
+        t_exact.append(time.perf_counter() - t0)
+    print(f"{'ef':>6} {'recall@' + str(k):>10} {'p50, us':>10}")
+    print(f"{'exact':>6} {1.0:>10.3f} {np.median(t_exact) * 1e6:>10.0f}")
+    for ef in efs:
+        searcher.set_ef(ef)
+        hits, times = 0, []
+        for q, truth in zip(queries, exact):
+            t0 = time.perf_counter()
+            idx, _ = searcher.knn(q, k)
+            times.append(time.perf_counter() - t0)
+            hits += len(np.intersect1d(idx[0], truth))
+        print(f"{ef:>6} {hits / (k * n_queries):>10.3f} {np.median(times) * 1e6:>10.0f}")
+
+
+def bench_ivfpq(n_items=100_000, dim=64, rank=16, k=10, n_queries=200, nprobes=(4, 16, 64), reranks=(0, 10)):
+    """recall@k, латентность и байты на айтем IVF-PQ против точного user_vec @ item_mat.T."""
+    from app.ivfpq import IVFPQIndex
+
+    # эмбеддинги MF почти низкоранговые — генерируем похожие, а не белый шум
+    rng = np.random.default_rng(0)
+    basis = rng.normal(size=(rank, dim))
+    items = (rng.normal(size=(n_items, rank)) @ basis + 0.3 * rng.normal(size=(n_items, dim))).astype(np.float32)
+    users = (rng.normal(size=(n_queries, rank)) @ basis).astype(np.float32)
+    t0 = time.perf_counter()
+    index = IVFPQIndex.train(items)
+    print(f"train: {time.perf_counter() - t0:.1f} s, {items.shape[1] * 4} -> {index.nbytes_per_item()} bytes/item")
+
+    exact, t_exact = [], []
+    for u in users:
+        t0 = time.perf_counter()
+        exact.append(select_top_k(u @ items.T, k)[0])
+        t_exact.append(time.perf_counter() - t0)
+    print(f"{'nprobe':>7} {'rerank':>7} {'recall@' + str(k):>10} {'p50, us':>10}")
+    print(f"{'exact':>7} {'-':>7} {1.0:>10.3f} {np.median(t_exact) * 1e6:>10.0f}")
+    for nprobe in nprobes:
+        for rerank in reranks:
+            hits, times = 0, []
+            for u, truth in zip(users, exact):
+                t0 = time.perf_counter()
+                cand, approx = index.search(u, k * max(rerank, 1), nprobe)
+                scores = items[cand] @ u if rerank else approx
+                top = cand[select_top_k(scores, k)[0]]
+                times.append(time.perf_counter() - t0)
+                hits += len(np.intersect1d(top, truth))
+            print(f"{nprobe:>7} {rerank:>7} {hits / (k * n_queries):>10.3f} {np.median(times) * 1e6:>10.0f}")
+
+
+def _skipgram_pairs_loop(ratings, item2idx, window=2):
+    # прежний build_skipgram_dataset без негативов: фильтр DataFrame на каждого пользователя
+    pairs = []
+    for u in ratings.user_id.unique():
+        seq = ratings[ratings.user_id == u].item_id.map(item2idx).tolist()
+        for idx, target in enumerate(seq):
+            for ctx in seq[max(0, idx - window): idx] + seq[idx + 1: idx + 1 + window]:
+                pairs.append((target, ctx))
+    return pairs
+
+
+def _skipgram_worker(n, mode, results):
+    from app.sampling import skipgram_pairs
+
+    df = synthetic_ratings(n, n_users=max(n // 50, 1), n_items=300_000).rename(columns={'book_id': 'item_id'})
+    i2i = {b: i for i, b in enumerate(df.item_id.unique())}
+    base = _peak_rss_mb()
+    t0 = time.perf_counter()
+    if mode == 'loop':
+        n_pairs = len(_skipgram_pairs_loop(df, i2i))
+    else:
+        n_pairs = int(skipgram_pairs(df, i2i)[2].sum())
+    results.put((n, mode, n_pairs, time.perf_counter() - t0, _peak_rss_mb() - base))
+
+
+def bench_skipgram(sizes=(1_000_000, 10_000_000), loop_sizes=(20_000, 100_000)):
+    """Пары skipgram (window=2, 1 негатив): цикл по пользователям против векторной генерации."""
+    import multiprocessing as mp
+    from collections import Counter
+    from app.sampling import skipgram_pairs
+
+    # то же мультимножество положительных пар, что у цикла
+    df = synthetic_ratings(5_000, n_users=100, n_items=500).rename(columns={'book_id': 'item_id'})
+    i2i = {b: i for i, b in enumerate(df.item_id.unique())}
+    t, c, y = skipgram_pairs(df, i2i)
+    same = Counter(zip(t[y == 1].tolist(), c[y == 1].tolist())) == Counter(_skipgram_pairs_loop(df, i2i))
+    print(f'same positive pairs as the loop: {same}')
+
+    # каждый замер в своём процессе — пик RSS не наследуется от предыдущего
+    ctx = mp.get_context('spawn')
+    print(f"{'ratings':>12} {'mode':>8} {'pairs':>12} {'s':>9} {'peak MB':>9}")
+    for n, mode in [(n, 'loop') for n in loop_sizes] + [(n, 'numpy') for n in sizes]:
+        results = ctx.Queue()
+        p = ctx.Process(target=_skipgram_worker, args=(n, mode, results))
+        p.start()
+        n, mode, n_pairs, secs, peak = results.get()
+        p.join()
+        print(f"{n:>12} {mode:>8} {n_pairs:>12} {secs:>9.2f} {peak:>9.0f}")
+
+
+BENCHMARKS = {
+    'interactions': bench_interactions,
+    'topk': bench_topk,
+    'batch': bench_batch,
+    'batch_endpoint': bench_batch_endpoint,
+    'sources': bench_sources,
+    'endpoint': bench_endpoint,
+    'microbatch': bench_microbatch,
+    'cross': bench_cross,
+    'columnar': bench_columnar,
+    'mmap': bench_mmap,
+    'startup': bench_startup,
+    'hnsw': bench_hnsw,
+    'ivfpq': bench_ivfpq,
+    'skipgram': bench_skipgram,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f'== {name}')
+        BENCHMARKS[name]()
@@ -0,0 +1,81 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# In-process кэш ответов /recommend: LRU с лимитом по памяти + TTL
+
+
+def _sizeof(key, value):
+    # грубая оценка: сам список, его элементы и ключ
+    return (sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+            + sys.getsizeof(key) + sum(sys.getsizeof(k) for k in key))
+
+
+class RecommendationCache:
+    def __init__(self, max_bytes=64 << 20, ttl=300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value, size)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._generations = {}  # (user_id, domain) -> поколение, см. invalidate
+
+    def key(self, user_id, domain, top_k, version, fusion=None):
+        # версия моделей в ключе: после переобучения старые записи просто не находятся;
+        # fusion — метод и веса слияния, если запрос их переопределил
+        gen = self._generations.get((user_id, domain), 0)
+        return (user_id, domain, top_k, version, fusion, gen)
+
+    def invalidate(self, user_id, domain):
+        """O(1): прежние ответы пользователя становятся недостижимы и вытесняются по LRU/TTL."""
+        with self._lock:
+            self._generations[(user_id, domain)] = self._generations.get((user_id, domain), 0) + 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value, size = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.bytes -= size
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = _sizeof(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._data[key] = (time.monotonic() + self.ttl, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generations.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -23,8 +23,8 @@ def make_collab_dataset(ratings, user2idx, item2idx, item_col):
 def build_collab_model(num_users, num_items, embedding_dim=64):
     user_in = tf.keras.Input(shape=(), name='user')
     item_in = tf.keras.Input(shape=(), name='item')
-    u_emb = tf.keras.layers.Embedding(num_users, embedding_dim)(user_in)
-    i_emb = tf.keras.layers.Embedding(num_items, embedding_dim)(item_in)
+    u_emb = tf.keras.layers.Embedding(num_users, embedding_dim, name='user_embedding')(user_in)
+    i_emb = tf.keras.layers.Embedding(num_items, embedding_dim, name='item_embedding')(item_in)
     dot = tf.keras.layers.Dot(axes=1)([u_emb, i_emb])
     out = tf.keras.layers.Flatten()(dot)
     model = tf.keras.Model([user_in, item_in], out)
@@ -0,0 +1,185 @@
+import json
+import os
+
+import numpy as np
+
+# Колоночный снапшот выгрузки из БД: вместо разбора четырёх CSV на каждый старт и /retrain —
+# типизированные .npy, которые открываются через mmap, причём только нужные колонки.
+#
+# data/columnar/<таблица>/<колонка>.npy
+#   *id, *_id                    — int32
+#   rating                       — uint8, если все оценки целые 0..255 (иначе float32)
+#   timestamp                    — datetime64[s], NaT для нераспознанных
+#   строки (genres, title, ...)  — словарь: <колонка>.codes.npy (int32, -1 = пусто) + <колонка>.dict.npy
+#   прочие числа                 — int64 / float32
+# data/columnar/arrays/<имя>.npy — производные массивы (маппинги ID, жанровые матрицы); сбрасываются
+#                                  при любой перезаписи таблиц
+# data/columnar/MANIFEST.json    — колонки таблиц и размер/mtime исходных CSV: устаревший снапшот не читается
+#
+# Имена колонок хранятся как в CSV; columns= при чтении сравнивает их без учёта регистра и '_'.
+
+TABLES = {
+    'book_ratings': 'book_ratings.csv',
+    'movie_ratings': 'movie_ratings.csv',
+    'books': 'books.csv',
+    'movies': 'movies.csv',
+}
+MANIFEST = 'MANIFEST.json'
+
+
+def columnar_dir(data_dir):
+    return os.path.join(data_dir, 'columnar')
+
+
+def _key(name):
+    return name.lower().replace('_', '')
+
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _encode(name, col):
+    """pandas-колонка -> {суффикс файла: ndarray}."""
+    import pandas as pd
+    key = _key(name)
+    if key == 'timestamp':
+        return {'': pd.to_datetime(col, errors='coerce').to_numpy(dtype='datetime64[s]')}
+    if pd.api.types.is_numeric_dtype(col):
+        values = col.to_numpy()
+        if key.endswith('id') and pd.api.types.is_integer_dtype(col):
+            if len(values) and (values.min() < np.iinfo(np.int32).min or values.max() > np.iinfo(np.int32).max):
+                return {'': values.astype(np.int64)}
+            return {'': values.astype(np.int32)}
+        if key == 'rating':
+            whole = np.all(np.mod(values, 1) == 0) and (not len(values) or (values.min() >= 0 and values.max() <= 255))
+            return {'': values.astype(np.uint8 if whole else np.float32)}
+        if pd.api.types.is_integer_dtype(col):
+            return {'': values.astype(np.int64)}
+        return {'': values.astype(np.float32)}
+    codes, uniques = pd.factorize(col)
+    return {'.codes': codes.astype(np.int32), '.dict': np.asarray(uniques, dtype=str)}
+
+
+def write_dataset(data_dir, frames=None, arrays=None):
+    """
+    frames: {таблица: DataFrame} в исходном виде из CSV; arrays: {имя: ndarray}.
+    Каждая таблица пишется целиком в новый каталог и подменяется одной операцией.
+    """
+    root = columnar_dir(data_dir)
+    os.makedirs(root, exist_ok=True)
+    manifest = read_manifest(data_dir) or {'tables': {}, 'arrays': []}
+    if frames:
+        # производные массивы (маппинги, жанровые матрицы) собраны из прежних таблиц — сбрасываем
+        for name in manifest['arrays']:
+            path = os.path.join(root, 'arrays', f'{name}.npy')
+            if os.path.isfile(path):
+                os.remove(path)
+        manifest['arrays'] = []
+    for table, df in (frames or {}).items():
+        tmp = os.path.join(root, f'.{table}.{os.getpid()}')
+        os.makedirs(tmp, exist_ok=True)
+        for name in df.columns:
+            for suffix, arr in _encode(name, df[name]).items():
+                np.save(os.path.join(tmp, f'{name}{suffix}.npy'), arr, allow_pickle=False)
+        final = os.path.join(root, table)
+        if os.path.isdir(final):
+            old = f'{final}.old.{os.getpid()}'
+            os.replace(final, old)
+            os.replace(tmp, final)
+            for fname in os.listdir(old):
+                os.remove(os.path.join(old, fname))
+            os.rmdir(old)
+        else:
+            os.replace(tmp, final)
+        source = os.path.join(data_dir, TABLES.get(table, ''))
+        manifest['tables'][table] = {
+            'columns': [str(c) for c in df.columns],
+            'rows': len(df),
+            'source': _source_stamp(source) if os.path.isfile(source) else None,
+        }
+    if arrays:
+        os.makedirs(os.path.join(root, 'arrays'), exist_ok=True)
+        for name, arr in arrays.items():
+            np.save(os.path.join(root, 'arrays', f'{name}.npy'), np.asarray(arr), allow_pickle=False)
+        manifest['arrays'] = sorted(set(manifest['arrays']) | set(arrays))
+    tmp = os.path.join(root, f'{MANIFEST}.{os.getpid()}')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(root, MANIFEST))
+    return root
+
+
+def read_manifest(data_dir):
+    try:
+        with open(os.path.join(columnar_dir(data_dir), MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(data_dir, tables=TABLES):
+    """Снапшот есть для всех таблиц и собран из тех же CSV (размер и mtime совпадают)."""
+    manifest = read_manifest(data_dir)
+    if manifest is None:
+        return False
+    for table in tables:
+        meta = manifest['tables'].get(table)
+        source = os.path.join(data_dir, TABLES[table])
+        if meta is None or (os.path.isfile(source) and meta['source'] != _source_stamp(source)):
+            return False
+    return True
+
+
+def read_table(data_dir, table, columns=None, mmap=True):
+    """
+    {колонка: ndarray | (codes, dict)}; columns — какие колонки читать (остальные не открываются).
+    При mmap=True массивы read-only и берутся с диска по мере обращения.
+    """
+    path = os.path.join(columnar_dir(data_dir), table)
+    wanted = None if columns is None else {_key(c) for c in columns}
+    mode = 'r' if mmap else None
+    out = {}
+    for name in read_manifest(data_dir)['tables'][table]['columns']:
+        if wanted is not None and _key(name) not in wanted:
+            continue
+        plain = os.path.join(path, f'{name}.npy')
+        if os.path.isfile(plain):
+            out[name] = np.load(plain, mmap_mode=mode, allow_pickle=False)
+        else:
+            out[name] = (np.load(os.path.join(path, f'{name}.codes.npy'), mmap_mode=mode, allow_pickle=False),
+                         np.load(os.path.join(path, f'{name}.dict.npy'), allow_pickle=False))
+    return out
+
+
+def read_frame(data_dir, table, columns=None, mmap=True):
+    """DataFrame без разбора текста; словарные колонки становятся pandas Categorical (строки не копируются)."""
+    import pandas as pd
+    cols = {}
+    for name, value in read_table(data_dir, table, columns, mmap).items():
+        if isinstance(value, tuple):
+            codes, uniques = value
+            cols[name] = pd.Categorical.from_codes(np.asarray(codes), categories=pd.Index(uniques))
+        else:
+            cols[name] = value
+    return pd.DataFrame(cols, copy=False)
+
+
+def read_arrays(data_dir, names, mmap=True):
+    manifest = read_manifest(data_dir) or {'arrays': []}
+    root = os.path.join(columnar_dir(data_dir), 'arrays')
+    return {name: np.load(os.path.join(root, f'{name}.npy'), mmap_mode='r' if mmap else None, allow_pickle=False)
+            for name in names if name in manifest['arrays']}
+
+
+def export_csvs(data_dir='data'):
+    """Перегнать выгруженные CSV в колоночный снапшот (шаг выгрузки и обучения)."""
+    import pandas as pd
+    frames = {table: pd.read_csv(os.path.join(data_dir, fname), low_memory=False)
+              for table, fname in TABLES.items() if os.path.isfile(os.path.join(data_dir, fname))}
+    return write_dataset(data_dir, frames)
+
+
+if __name__ == '__main__':
+    export_csvs()
@@ -0,0 +1,180 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: журнал пишет один процесс, хватает блокировки потоков
+    fcntl = None
+
+# Журнал событий /events (оценки и избранное), общий для всех воркеров.
+#
+# data/events/seg_<первый seq>.log    — append-only сегменты фиксированных бинарных записей EVENT
+# data/events/compacted_<domain>.npz  — итог компакции колонками: последняя оценка по (пользователь, айтем)
+# data/events/WATERMARK               — seq последнего события, ушедшего в компакцию (опрос не трогает npz)
+# data/events/LOCK                    — flock на запись и компакцию
+#
+# seq сквозной и монотонный. Лоадер помнит seq последнего события, вошедшего в его индексы
+# (и в снапшот), поэтому на рестарте переигрывается только хвост после него.
+
+DOMAINS = ('books', 'movies')
+KINDS = ('rating', 'favourite')
+EVENT = np.dtype([('seq', '<i8'), ('ts', '<f8'), ('user_id', '<i8'), ('item_id', '<i8'),
+                  ('rating', '<f4'), ('domain', 'u1'), ('kind', 'u1')])
+COMPACTED = ('seq', 'ts', 'user_id', 'item_id', 'rating')
+WATERMARK = 'WATERMARK'
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    # недописанная запись в хвосте (процесс упал посреди write) отбрасывается
+    return np.frombuffer(raw[:len(raw) - len(raw) % EVENT.itemsize], dtype=EVENT)
+
+
+def _count(path):
+    return os.path.getsize(path) // EVENT.itemsize
+
+
+def _latest(cols):
+    """Последняя по seq запись для каждой пары (user_id, item_id)."""
+    order = np.lexsort((cols['seq'], cols['item_id'], cols['user_id']))
+    user, item = cols['user_id'][order], cols['item_id'][order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (user[1:] != user[:-1]) | (item[1:] != item[:-1])
+    return {name: col[order][last] for name, col in cols.items()}
+
+
+class EventLog:
+    def __init__(self, root, segment_events=100_000, fsync=False):
+        self.root = root
+        self.segment_events = segment_events
+        self.fsync = fsync
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def _lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with self._thread_lock, open(os.path.join(self.root, 'LOCK'), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _segment(self, first_seq):
+        return os.path.join(self.root, f'seg_{first_seq:012d}.log')
+
+    def segments(self):
+        if not os.path.isdir(self.root):
+            return []
+        names = sorted(n for n in os.listdir(self.root) if n.startswith('seg_') and n.endswith('.log'))
+        return [os.path.join(self.root, n) for n in names]
+
+    def _next_seq(self, segments):
+        # последний непустой сегмент -> его последняя запись; пустой сегмент назван следующим seq
+        for path in reversed(segments):
+            n = _count(path)
+            if n:
+                with open(path, 'rb') as f:
+                    f.seek((n - 1) * EVENT.itemsize)
+                    return int(np.frombuffer(f.read(EVENT.itemsize), dtype=EVENT)['seq'][0]) + 1
+        if segments:
+            return int(os.path.basename(segments[-1])[4:-4])
+        return self.watermark() + 1
+
+    def append(self, domains, kinds, user_ids, item_ids, ratings, timestamps):
+        """Дописывает пачку событий одной записью; возвращает их как массив EVENT с присвоенными seq."""
+        with self._lock():
+            segments = self.segments()
+            seq = self._next_seq(segments)
+            if not segments or _count(segments[-1]) >= self.segment_events:
+                segments.append(self._segment(seq))
+            events = np.zeros(len(user_ids), dtype=EVENT)
+            events['seq'] = np.arange(seq, seq + len(events))
+            events['ts'], events['user_id'], events['item_id'] = timestamps, user_ids, item_ids
+            events['rating'] = ratings
+            events['domain'] = [DOMAINS.index(d) for d in domains]
+            events['kind'] = [KINDS.index(k) for k in kinds]
+            with open(segments[-1], 'ab') as f:
+                f.truncate(_count(segments[-1]) * EVENT.itemsize)  # хвост от оборванной записи
+                f.write(events.tobytes())
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            return events
+
+    def compacted(self, domain):
+        path = os.path.join(self.root, f'compacted_{domain}.npz')
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as f:
+            return {name: f[name] for name in COMPACTED}
+
+    def watermark(self):
+        """seq последнего события, уже перенесённого в compacted_*.npz (0 — компакций не было)."""
+        try:
+            with open(os.path.join(self.root, WATERMARK)) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            # компакция без сайдкара (или он недописан) — считаем по самим npz
+            seqs = [c['seq'].max() for c in map(self.compacted, DOMAINS) if c is not None and len(c['seq'])]
+            return int(max(seqs)) if seqs else 0
+
+    def _write_watermark(self, seq):
+        tmp = os.path.join(self.root, f'{WATERMARK}.tmp')
+        with open(tmp, 'w') as f:
+            f.write(str(seq))
+        os.replace(tmp, os.path.join(self.root, WATERMARK))
+
+    def compact(self):
+        """Все сегменты -> compacted_<domain>.npz; запись продолжается в новом пустом сегменте."""
+        with self._lock():
+            segments = self.segments()
+            events = np.concatenate([_read(p) for p in segments]) if segments else np.zeros(0, EVENT)
+            if not len(events):
+                return 0
+            # новый активный сегмент до удаления старых — seq продолжается с того же места
+            open(self._segment(self._next_seq(segments)), 'ab').close()
+            for d, domain in enumerate(DOMAINS):
+                new = events[events['domain'] == d]
+                if not len(new):
+                    continue
+                old = self.compacted(domain)
+                cols = {name: new[name] if old is None else np.concatenate([old[name], new[name]])
+                        for name in COMPACTED}
+                tmp = os.path.join(self.root, f'compacted_{domain}.tmp.npz')
+                np.savez(tmp, **_latest(cols))
+                os.replace(tmp, os.path.join(self.root, f'compacted_{domain}.npz'))
+            self._write_watermark(int(events['seq'].max()))
+            for path in segments:
+                os.remove(path)
+            return len(events)
+
+    def replay(self, after_seq):
+        """События с seq > after_seq в порядке seq: из компакции (если хвост туда уже ушёл) и из сегментов."""
+        with self._lock():  # иначе компакция может перенести хвост между чтением watermark и сегментов
+            return self._replay(after_seq)
+
+    def _replay(self, after_seq):
+        parts = []
+        if after_seq < self.watermark():
+            for d, domain in enumerate(DOMAINS):
+                cols = self.compacted(domain)
+                if cols is None:
+                    continue
+                keep = cols['seq'] > after_seq
+                part = np.zeros(int(keep.sum()), dtype=EVENT)
+                for name in COMPACTED:
+                    part[name] = cols[name][keep]
+                part['domain'] = d
+                parts.append(part)
+        for path in self.segments():
+            events = _read(path)
+            parts.append(events[events['seq'] > after_seq])
+        events = np.concatenate(parts) if parts else np.zeros(0, dtype=EVENT)
+        return events[np.argsort(events['seq'], kind='stable')]
@@ -0,0 +1,50 @@
+import heapq
+from typing import NamedTuple
+
+import numpy as np
+
+# Слияние источников (collab / content / cross) в один список рекомендаций.
+# Каждый источник отдаёт [Rec, ...] лучшими первыми; дубли между источниками
+# складываются в словаре за один проход — вклад айтема суммируется.
+
+SOURCES = ('collab', 'content', 'cross')
+METHODS = ('rrf', 'score')
+
+
+class Rec(NamedTuple):
+    item_id: int
+    score: float
+    source: str
+
+
+def to_recs(ids, scores, source):
+    return [Rec(i, s, source) for i, s in zip(np.asarray(ids).tolist(), np.asarray(scores, dtype=np.float64).tolist())]
+
+
+def _contributions(recs, method, rrf_k):
+    if method == 'rrf':
+        # reciprocal rank fusion: шкалы скоров источников несравнимы, ранги — сравнимы
+        return [1.0 / (rrf_k + rank) for rank in range(1, len(recs) + 1)]
+    if method == 'score':
+        # min-max внутри источника: лучший айтем источника получает 1, худший — 0
+        lo = min(r.score for r in recs)
+        span = max(r.score for r in recs) - lo
+        return [(r.score - lo) / span if span > 0 else 1.0 for r in recs]
+    raise ValueError(f'Unknown fusion method: {method}')
+
+
+def fuse(results, top_k, weights=None, method='rrf', rrf_k=60):
+    """
+    results: {источник: [Rec, ...]}; weights: {источник: вес}, по умолчанию 1.0 для всех.
+    Возвращает до top_k ID айтемов; при равенстве выигрывает источник, идущий раньше.
+    """
+    weights = weights or {}
+    fused = {}
+    for source, recs in results.items():
+        w = weights.get(source, 1.0)
+        if w <= 0 or not recs:
+            continue
+        for rec, c in zip(recs, _contributions(recs, method, rrf_k)):
+            fused[rec.item_id] = fused.get(rec.item_id, 0.0) + w * c
+    # nlargest с key стабилен, как sorted(..., reverse=True)[:top_k]
+    return heapq.nlargest(top_k, fused, key=fused.__getitem__)
@@ -0,0 +1,85 @@
+import numpy as np
+
+# CSR-индекс истории пользователей: offsets[u]:offsets[u + 1] — срез его айтемов и оценок.
+# Дозаписанные после загрузки оценки (fold-in) лежат в overrides целиком по пользователю,
+# сам CSR не перестраивается — кроме merged() при записи снапшота.
+
+
+class InteractionIndex:
+    def __init__(self, offsets, items, ratings):
+        self.offsets = offsets
+        self.items = items
+        self.ratings = ratings
+        self.overrides = {}  # uid -> (items, ratings)
+
+    @classmethod
+    def from_ratings(cls, ratings_df, user2idx, item2idx, item_col):
+        users = ratings_df.user_id.map(user2idx).to_numpy(dtype=np.float64)
+        items = ratings_df[item_col].map(item2idx).to_numpy(dtype=np.float64)
+        keep = ~(np.isnan(users) | np.isnan(items))
+        users = users[keep].astype(np.int64)
+        items = items[keep].astype(np.int32)
+        ratings = ratings_df.rating.to_numpy(dtype=np.float32)[keep]
+
+        # stable, чтобы внутри пользователя сохранился порядок из файла
+        order = np.argsort(users, kind='stable')
+        offsets = np.zeros(len(user2idx) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(users, minlength=len(user2idx)), out=offsets[1:])
+        return cls(offsets, items[order], ratings[order])
+
+    @property
+    def num_users(self):
+        return len(self.offsets) - 1
+
+    def history(self, uid):
+        """Айтемы и оценки пользователя по его индексу — O(длина истории)."""
+        if uid in self.overrides:
+            return self.overrides[uid]
+        start, end = self.offsets[uid], self.offsets[uid + 1]
+        return self.items[start:end], self.ratings[start:end]
+
+    def items_of(self, uid):
+        return self.history(uid)[0]
+
+    def add(self, uid, items, ratings):
+        """
+        Дописать оценки пользователя; uid за пределами CSR — новый пользователь.
+        Повторная оценка айтема заменяет прежнюю. Возвращает обновлённую историю.
+        """
+        if uid in self.overrides or uid < self.num_users:
+            old_items, old_ratings = self.history(uid)
+        else:
+            old_items, old_ratings = self.items[:0], self.ratings[:0]
+        latest = dict(zip(np.asarray(items).tolist(), np.asarray(ratings, dtype=np.float32).tolist()))
+        new_items = np.fromiter(latest, dtype=np.int32, count=len(latest))
+        new_ratings = np.fromiter(latest.values(), dtype=np.float32, count=len(latest))
+        keep = ~np.isin(old_items, new_items)
+        # новый кортеж целиком: читатели в других потоках видят либо старую историю, либо новую
+        self.overrides[uid] = (np.concatenate([old_items[keep], new_items]),
+                               np.concatenate([old_ratings[keep], new_ratings]))
+        return self.overrides[uid]
+
+    def merged(self, num_users=None):
+        """Новый CSR с overrides внутри (и новыми пользователями до num_users) — для снапшота."""
+        overrides = dict(self.overrides)
+        num_users = max(num_users or 0, self.num_users, max(overrides, default=-1) + 1)
+        if not overrides and num_users == self.num_users:
+            return self
+        lengths = np.zeros(num_users, dtype=np.int64)
+        lengths[:self.num_users] = np.diff(self.offsets)
+        for uid, (items, _) in overrides.items():
+            lengths[uid] = len(items)
+        offsets = np.zeros(num_users + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        items = np.empty(offsets[-1], dtype=self.items.dtype)
+        ratings = np.empty(offsets[-1], dtype=self.ratings.dtype)
+        # нетронутые пользователи — одним сдвигом своих срезов, переписанные — из overrides
+        owner = np.repeat(np.arange(self.num_users), np.diff(self.offsets))
+        keep = ~np.isin(owner, list(overrides))
+        src = np.flatnonzero(keep)
+        dst = offsets[owner[keep]] + src - self.offsets[owner[keep]]
+        items[dst], ratings[dst] = self.items[src], self.ratings[src]
+        for uid, (it, r) in overrides.items():
+            items[offsets[uid]:offsets[uid + 1]] = it
+            ratings[offsets[uid]:offsets[uid + 1]] = r
+        return InteractionIndex(offsets, items, ratings)
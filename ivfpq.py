@@ -0,0 +1,142 @@
+import numpy as np
+
+# IVF-PQ для maximum inner product search по item-эмбеддингам collab-модели.
+#
+# MIPS сводится к обычному L2-поиску norm-augmentation'ом: к каждому айтему
+# дописываем sqrt(M² - |x|²), к запросу — 0. Тогда |x' - q'|² = M² + |q|² - 2 q·x,
+# и ближайший по L2 — это айтем с наибольшим скалярным произведением.
+# Дальше классика: грубый k-means (inverted lists) + PQ-коды остатков по 1 байту на подвектор.
+
+
+def _sq_dists(x, centroids):
+    return (x * x).sum(1)[:, None] - 2.0 * x @ centroids.T + (centroids * centroids).sum(1)[None, :]
+
+
+def _assign(x, centroids, chunk=65536):
+    out = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk):
+        out[start:start + chunk] = _sq_dists(x[start:start + chunk], centroids).argmin(1)
+    return out
+
+
+def kmeans(x, k, iters=20, sample=100_000, seed=0):
+    """Lloyd на подвыборке; возвращает (центроиды, назначение всех точек)."""
+    rng = np.random.default_rng(seed)
+    train = x[rng.choice(len(x), min(len(x), sample), replace=False)]
+    k = min(k, len(train))
+    centroids = train[rng.choice(len(train), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(train, centroids)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, train)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # пустые кластеры переинициализируем случайными точками
+        centroids[empty] = train[rng.choice(len(train), int(empty.sum()))]
+    return centroids, _assign(x, centroids)
+
+
+def augment(items):
+    """Norm-augmentation: (items, M) -> items с доп. координатой sqrt(M² - |x|²)."""
+    norms2 = (items * items).sum(1)
+    max_norm2 = float(norms2.max())
+    extra = np.sqrt(np.maximum(max_norm2 - norms2, 0.0))[:, None]
+    return np.hstack([items, extra]).astype(np.float32), max_norm2
+
+
+class IVFPQIndex:
+    ARRAYS = ('coarse', 'codebooks', 'codes', 'list_offsets', 'list_ids', 'meta')
+
+    def __init__(self, coarse, codebooks, codes, list_offsets, list_ids, meta):
+        self.coarse = coarse            # (nlist, D')
+        self.codebooks = codebooks      # (m, ksub, dsub)
+        self.codes = codes              # (n, m) uint8, отсортированы по спискам
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids        # int32: позиция в codes -> индекс айтема
+        self.meta = meta                # [dim, max_norm2]
+        self._book_t = np.ascontiguousarray(codebooks.transpose(0, 2, 1))  # (m, dsub, ksub)
+        self._book_norms = (codebooks * codebooks).sum(-1)                  # (m, ksub)
+
+    @property
+    def dim(self):
+        return int(self.meta[0])
+
+    @classmethod
+    def train(cls, items, nlist=None, m=32, ksub=256, iters=20, seed=0):
+        items = np.asarray(items, dtype=np.float32)
+        n, dim = items.shape
+        x, max_norm2 = augment(items)
+        pad = -x.shape[1] % m
+        if pad:
+            x = np.hstack([x, np.zeros((n, pad), dtype=np.float32)])
+        dsub = x.shape[1] // m
+
+        nlist = nlist or max(1, int(4 * np.sqrt(n)))
+        coarse, assign = kmeans(x, nlist, iters, seed=seed)
+        residuals = x - coarse[assign]
+
+        ksub = min(ksub, n, 256)
+        codebooks = np.zeros((m, ksub, dsub), dtype=np.float32)
+        codes = np.empty((n, m), dtype=np.uint8)
+        for j in range(m):
+            sub = np.ascontiguousarray(residuals[:, j * dsub:(j + 1) * dsub])
+            book, codes[:, j] = kmeans(sub, ksub, iters, seed=seed + j + 1)
+            codebooks[j, :len(book)] = book
+
+        order = np.argsort(assign, kind='stable')
+        list_offsets = np.zeros(len(coarse) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(coarse)), out=list_offsets[1:])
+        meta = np.array([dim, max_norm2], dtype=np.float64)
+        return cls(coarse, codebooks, codes[order], list_offsets, order.astype(np.int32), meta)
+
+    def _query(self, q):
+        q = np.asarray(q, dtype=np.float32).ravel()
+        return np.concatenate([q, np.zeros(self.coarse.shape[1] - len(q), dtype=np.float32)])
+
+    def search(self, q, k, nprobe=8):
+        """(индексы айтемов, приближённые скалярные произведения), лучшие первыми."""
+        qa = self._query(q)
+        nprobe = min(nprobe, len(self.coarse))
+        lists = np.argpartition(_sq_dists(qa[None, :], self.coarse)[0], nprobe - 1)[:nprobe]
+
+        m, ksub, dsub = self.codebooks.shape
+        starts, ends = self.list_offsets[lists], self.list_offsets[lists + 1]
+        lens = ends - starts
+        total = int(lens.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        # позиции всех айтемов из выбранных списков одним массивом
+        which = np.repeat(np.arange(len(lists)), lens)
+        pos = np.arange(total) + np.repeat(starts - (np.cumsum(lens) - lens), lens)
+
+        # ADC: для каждого списка — таблица расстояний подвекторов остатка запроса до кодбуков
+        # |r - c|² = |r|² - 2 r·c + |c|²; |r|² одинаков внутри подпространства, но нужен для скора
+        r = (qa[None, :] - self.coarse[lists]).reshape(len(lists), m, 1, dsub)
+        tables = (self._book_norms - 2.0 * (r @ self._book_t)[:, :, 0, :]
+                  + (r * r).sum(-1))                                # (nprobe, m, ksub)
+        dists = tables[which[:, None], np.arange(m)[None, :], self.codes[pos]].sum(1)
+        ids = self.list_ids[pos]
+        k = min(k, len(ids))
+        top = np.argpartition(dists, k - 1)[:k]
+        top = top[np.argsort(dists[top], kind='stable')]
+        q2 = float(qa @ qa)
+        return ids[top].astype(np.int64), (self.meta[1] + q2 - dists[top]) / 2.0
+
+    def nbytes_per_item(self):
+        return self.codes.shape[1] * self.codes.itemsize + self.list_ids.itemsize
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(*(arrays[name] for name in cls.ARRAYS))
+
+    def save(self, path):
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls.from_arrays({name: f[name] for name in cls.ARRAYS})
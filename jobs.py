@@ -0,0 +1,59 @@
+import threading
+import time
+import traceback
+
+# Состояние фонового переобучения для /retrain/status
+
+
+class RetrainJob:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.status = "idle"  # idle | running | done | failed
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    def try_start(self):
+        """Переводит задачу в running; False, если переобучение уже идёт."""
+        with self._lock:
+            if self.status == "running":
+                return False
+            self.status = "running"
+            self.stage, self.done, self.total = "queued", 0, 0
+            self.started_at, self.finished_at, self.error = time.time(), None, None
+            return True
+
+    def progress(self, stage, done, total):
+        with self._lock:
+            self.stage, self.done, self.total = stage, done, total
+
+    def finish(self):
+        with self._lock:
+            self.status, self.stage = "done", None
+            self.finished_at = time.time()
+
+    def fail(self, exc):
+        with self._lock:
+            self.status = "failed"
+            self.error = "".join(traceback.format_exception_only(type(exc), exc)).strip()
+            self.finished_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "status": self.status,
+                "stage": self.stage,
+                "progress": self.done / self.total if self.total else 0.0,
+                "done": self.done,
+                "total": self.total,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "error": self.error,
+            }
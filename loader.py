@@ -1,50 +1,182 @@
+import hashlib
 import os
+import threading
 import numpy as np
-import pandas as pd
 
-from models.collaborative import build_collab_model, build_mappings as collab_maps
-from models.content import build_content_model, build_genre_matrix
-from models.translator import Translator
+from app.scoring import CollabScorer, ContentScorer, CrossTable, DenseTranslator, extract_collab_tables
+from app.interactions import InteractionIndex
+from app.snapshot import TopKStore, current_version, read_snapshot, write_snapshot
+from app.ann import hnsw_path, load_hnsw_index
+from app.ivfpq import IVFPQIndex
+from app.events import DOMAINS, EventLog
+from app.popularity import Popularity
+from app.settings import Settings
 
 class ModelLoader:
     def __init__(self, data_dir='data', out_dir='outputs'):
         self.data_dir = data_dir
         self.out_dir = out_dir
         self.models = {}
+        self.scorers = {}
+        self.ann = {}
+        self.ivf = {}
+        self.cross = {}  # предпосчитанные таблицы переводчиков, только в режиме CROSS_MODE=table
+        self.topk = {}
+        self.popularity = {}  # домен -> Popularity для пользователей без истории
+        # пользователи с активностью новее моделей: для них предпосчитанный top-K устарел
+        self.fresh_users = {'books': set(), 'movies': set()}
+        self.version = None
+        self._fold_lock = threading.Lock()
+        self._seq_lock = threading.Lock()  # applied_seq, popularity_seq и счётчики популярности
+        # журнал /events: events_seq — последнее событие, вошедшее в индексы при сборке (и в снапшот),
+        # applied_seq — последнее применённое поверх них через fold-in,
+        # popularity_seq — последнее учтённое в счётчиках популярности (они сохраняются в снапшот с хвостом)
+        self.events = EventLog(os.path.join(data_dir, 'events'), Settings.EVENTS_SEGMENT, Settings.EVENTS_FSYNC)
+        self.events_seq = 0
+        self.applied_seq = 0
+        self.popularity_seq = 0
+        self.snapshot_dir = os.path.join(out_dir, 'serving')
 
-    def _normalize_ratings(self, df):
-        df.columns = [c.lower() for c in df.columns]
-        rename = {}
-        for old, new in [('userid','user_id'), ('bookid','book_id'), ('movieid','movie_id')]:
-            if old in df.columns:
-                rename[old] = new
-        return df.rename(columns=rename) if rename else df
+    def missing(self, names):
+        """Какие из нужных моделей/скореров ещё не загружены."""
+        return [n for n in names if n not in self.models and n not in self.scorers]
 
-    def _normalize_items(self, df):
-        df.columns = [c.lower() for c in df.columns]
-        if 'genre' in df.columns and 'genres' not in df.columns:
-            df = df.rename(columns={'genre': 'genres'})
-        return df
+    def fold_in(self, domain, user_id, ratings):
+        """
+        Новые оценки {item_id: rating} без переобучения: история пользователя дописывается,
+        в collab пересчитывается только его строка; cross и content берут историю из того же индекса.
+        Айтемы, которых нет в моделях, пропускаются. Возвращает (принято оценок, новый ли пользователь).
+        """
+        if domain == 'books':
+            user2idx, item2idx, index, key = self.u2b, self.b2idx, self.br_index, 'collab_book'
+        else:
+            user2idx, item2idx, index, key = self.u2m, self.m2idx, self.mr_index, 'collab_movie'
+        known = [(item2idx[i], r) for i, r in ratings.items() if i in item2idx]
+        if not known:
+            return 0, False
+        with self._fold_lock:
+            new_user = user_id not in user2idx
+            uid = len(user2idx) if new_user else user2idx[user_id]
+            items, rates = index.add(uid, *zip(*known))
+            scorer = self.scorers.get(key)
+            if scorer is not None:
+                scorer.fold_in(uid, items, rates, Settings.FOLD_IN_REG)
+            # читатели идут без блокировки: uid публикуется последним, когда история и строка уже есть
+            if new_user:
+                user2idx[user_id] = uid
+            self.fresh_users[domain].add(user_id)
+        return len(known), new_user
 
-    def load_all(self):
-        # 1) Ratings
-        br_path = os.path.join(self.data_dir, 'book_ratings.csv')
-        mr_path = os.path.join(self.data_dir, 'movie_ratings.csv')
-        if not (os.path.isfile(br_path) and os.path.isfile(mr_path)):
-            return  # не выгружено из БД ещё — ничего не грузим
+    def apply_events(self, events):
+        """Массив EVENT -> fold-in по одному на (домен, пользователь). Возвращает затронутые (user_id, domain)."""
+        if self.version is None:
+            return []
+        groups = {}
+        for user_id, item_id, rating, d in zip(events['user_id'].tolist(), events['item_id'].tolist(),
+                                               events['rating'].tolist(), events['domain'].tolist()):
+            groups.setdefault((user_id, DOMAINS[d]), {})[item_id] = rating  # позднее событие побеждает
+        for (user_id, domain), ratings in groups.items():
+            self.fold_in(domain, user_id, ratings)
+        return list(groups)
+
+    def replay_events(self):
+        """Хвост журнала новее applied_seq: после снапшота на рестарте и события соседних воркеров."""
+        if self.version is None:
+            return []
+        events = self.events.replay(self.applied_seq)
+        if not len(events):
+            return []
+        touched = self.apply_events(events)
+        with self._seq_lock:
+            self._advance(events)
+        return touched
+
+    def apply_appended(self, events):
+        """
+        События, только что дописанные в журнал этим воркером (/events, /ratings): fold-in сразу.
+        Если до них ничего не пропущено, applied_seq сдвигается за них — replay их не повторит;
+        иначе перед ними есть события соседей, и их вместе с этими подберёт следующий replay.
+        """
+        touched = self.apply_events(events)
+        with self._seq_lock:
+            if self.version is not None and int(events['seq'][0]) == self.applied_seq + 1:
+                self._advance(events)
+        return touched
+
+    def _advance(self, events):
+        # events — применённые подряд за applied_seq, по возрастанию seq; вызывается под _seq_lock
+        self._add_popularity(events[events['seq'] > self.popularity_seq])
+        self.applied_seq = max(self.applied_seq, int(events['seq'][-1]))
+        self.popularity_seq = max(self.popularity_seq, self.applied_seq)
+
+    def _add_popularity(self, events):
+        # только через _advance: каждое событие учитывается ровно один раз по seq.
+        # Индексы и fold-in после снапшота переигрываются от events_seq, а счётчики — от popularity_seq:
+        # в снапшот они попадают уже с хвостом журнала
+        for d, domain in enumerate(DOMAINS):
+            pop = self.popularity.get(domain)
+            if pop is None:
+                continue
+            item2idx = self.b2idx if domain == 'books' else self.m2idx
+            ev = events[events['domain'] == d]
+            known = [j for j, i in enumerate(ev['item_id'].tolist()) if i in item2idx]
+            if not known:
+                continue
+            ev = ev[known]
+            pop.add([item2idx[i] for i in ev['item_id'].tolist()], ev['rating'], ev['ts'])
+            pop.refresh()
+
+    def _build_popularity(self, domain, df, item2idx, item_col, mat, genres):
+        import pandas as pd
+        items = df[item_col].map(item2idx).to_numpy(dtype=np.float64)
+        keep = ~np.isnan(items)
+        ts = None
+        if 'timestamp' in df.columns:
+            t = pd.to_datetime(df['timestamp'], errors='coerce')
+            if t.notna().any():
+                # без времени оценка в тренд не попадает: вес 2^(-∞) = 0
+                # явно в секунды: у колоночного снапшота и pandas 2+ разрешение [s]/[us], не только [ns]
+                secs = t.to_numpy('datetime64[s]').astype(np.int64).astype(np.float64)
+                ts = np.where(t.notna(), secs, -np.inf)[keep]
+        self.popularity[domain] = Popularity.from_ratings(
+            items[keep].astype(np.int64), df.rating.to_numpy(dtype=np.float64)[keep], ts, len(item2idx),
+            Settings.POPULAR_HALF_LIFE_DAYS * 86400, mat, genres, Settings.POPULAR_LIST_SIZE,
+        )
 
-        self.df_br = self._normalize_ratings(pd.read_csv(br_path))
-        self.df_mr = self._normalize_ratings(pd.read_csv(mr_path))
+    def _artifacts_version(self):
+        """Версия = хэш имён, размеров и mtime всех файлов, из которых собран лоадер."""
+        h = hashlib.sha1()
+        for d in (self.data_dir, self.out_dir):
+            if not os.path.isdir(d):
+                continue
+            for name in sorted(os.listdir(d)):
+                path = os.path.join(d, name)
+                if os.path.isfile(path):
+                    st = os.stat(path)
+                    h.update(f'{path}:{st.st_size}:{st.st_mtime_ns};'.encode())
+        h.update(f'events:{self.events_seq}'.encode())
+        return h.hexdigest()[:12]
 
-        # 2) Items
-        books_path = os.path.join(self.data_dir, 'books.csv')
-        movies_path = os.path.join(self.data_dir, 'movies.csv')
-        self.books_df = self._normalize_items(pd.read_csv(books_path, low_memory=False))
-        self.movies_df = self._normalize_items(pd.read_csv(movies_path, low_memory=False))
+    def load_all(self):
+        # pandas и TF нужны только для сборки из выгрузки/h5 — сервинг из снапшота их не импортирует
+        from models.collaborative import build_collab_model
+        from models.content import build_content_model
+        from app.preprocess import PREPARED, load_prepared, prepare
+
+        # 1-3) Ratings, items, индексы — ровно те, на которых обучены веса (app.train сохраняет их рядом);
+        # для весов, обученных до этого, — заново из выгрузки
+        data = load_prepared(os.path.join(self.out_dir, PREPARED)) or prepare(self.data_dir, self.events)
+        if data is None:
+            return  # не выгружено из БД ещё — ничего не грузим
+        self.events_seq = data.events_seq
+        b, m = data.books, data.movies
+        self.df_br, self.df_mr = b.ratings, m.ratings
+        self.books_df, self.movies_df = b.items, m.items
+        self.u2b, self.b2idx, self.u2m, self.m2idx = b.user2idx, b.item2idx, m.user2idx, m.item2idx
 
-        # 3) Collab mappings
-        self.u2b, self.b2idx = collab_maps(self.df_br, 'book_id')
-        self.u2m, self.m2idx = collab_maps(self.df_mr, 'movie_id')
+        # Обратные таблицы индекс -> ID, чтобы маппить top-k одной индексацией
+        self.idx2b, self.idx2m, self.idx2ub, self.idx2um = b.idx2item, m.idx2item, b.idx2user, m.idx2user
+        self.br_index, self.mr_index = b.index, m.index
 
         # 4) Collaborative
         for key, (u2i, wfile, builder) in {
@@ -57,24 +189,24 @@ class ModelLoader:
                 m = model_fn()
                 m.load_weights(path)
                 self.models[key] = m
+                self.scorers[key] = CollabScorer(*extract_collab_tables(m))
+                ivf_path = os.path.join(self.out_dir, f'{key}_ivfpq.npz')
+                if Settings.COLLAB_IVF and os.path.isfile(ivf_path):
+                    self.ivf[key] = IVFPQIndex.load(ivf_path)
 
         # 5) Content + genres
-        # Content для книг:
-        self.b_mat, _ = build_genre_matrix(
-            self.books_df,
-            self.b2idx,
-            id_col='book_id',    # ← СЕЙЧАС КОРРЕКТНО
-            genres_col='genres'
-        )
-
-        # Content для фильмов:
-        self.m_mat, _ = build_genre_matrix(
-            self.movies_df,
-            self.m2idx,
-            id_col='movie_id',   # ← ТАК ЖЕ
-            genres_col='genres'
-        )
+        self.b_mat, self.b_genres, self.m_mat, self.m_genres = b.genre_mat, b.genres, m.genre_mat, m.genres
+        self._build_popularity('books', self.df_br, self.b2idx, 'book_id', self.b_mat, self.b_genres)
+        self._build_popularity('movies', self.df_mr, self.m2idx, 'movie_id', self.m_mat, self.m_genres)
 
+        # Content-модели прогоняем по жанрам всех айтемов один раз — в запросе сети нет
+        for key, mat in [('content_book', self.b_mat), ('content_movie', self.m_mat)]:
+            path = os.path.join(self.out_dir, f'{key}_weights.h5')
+            if os.path.isfile(path):
+                m = build_content_model(mat.shape[1])
+                m.load_weights(path)
+                preds = m.predict(mat, batch_size=4096, verbose=0)
+                self.scorers[key] = ContentScorer.from_predictions(mat, preds, Settings.CONTENT_QUALITY_WEIGHT)
 
         # 6) Embeddings + translators
         b_embp = os.path.join(self.out_dir, 'book_embeddings.npy')
@@ -82,15 +214,190 @@ class ModelLoader:
         if os.path.isfile(b_embp) and os.path.isfile(m_embp):
             self.book_embs = np.load(b_embp)
             self.movie_embs = np.load(m_embp)
+            self._load_translators()
+            self._build_cross_tables()
+            self._load_ann(build_missing=True)  # публикация снапшота: индекс строим тут, не в сервинге
+
+        self.version = self._artifacts_version()
+        self.applied_seq = self.popularity_seq = self.events_seq
+        self.replay_events()  # сегменты, ещё не ушедшие в компакцию
+
+    def _load_ann(self, build_missing=False):
+        # индексы лежат рядом с эмбеддингами; строятся при обучении и в load_all перед публикацией
+        # снапшота. Воркеры из снапшота только читают: без индекса — точный скан
+        if not Settings.CROSS_ANN:
+            return
+        targets = [('book', self.book_embs, 'movie2book'), ('movie', self.movie_embs, 'book2movie')]
+        for name, embs, key in targets:
+            fname = name
+            if Settings.CROSS_MODE == 'table':
+                # косинус = ip по нормированным целям: отдельный индекс над targets таблицы
+                if key not in self.cross:
+                    continue
+                fname, embs = f'{name}_unit', self.cross[key].targets
+            searcher = load_hnsw_index(hnsw_path(self.out_dir, fname), embs, ef=Settings.HNSW_EF,
+                                       build_missing=build_missing)
+            if searcher is not None:
+                self.ann[name] = searcher
+
+    def _load_translators(self):
+        from models.translator import Translator
+
+        for key, dim in [('book2movie', self.book_embs.shape[1]), ('movie2book', self.movie_embs.shape[1])]:
+            path = os.path.join(self.out_dir, f'{key}_weights.h5')
+            if os.path.isfile(path):
+                t = Translator(dim)
+                t(np.zeros((1, dim), dtype=np.float32))  # subclassed-модель надо построить до load_weights
+                t.load_weights(path)
+                self.models[key] = t
+                self.scorers[key] = DenseTranslator.from_keras(t)
+
+    def _build_cross_tables(self, arrays=None):
+        # переводчик по всем айтемам источника — один раз при загрузке, а не на каждый запрос
+        if Settings.CROSS_MODE != 'table':
+            return
+        for key, src, tgt in [('book2movie', self.book_embs, self.movie_embs),
+                              ('movie2book', self.movie_embs, self.book_embs)]:
+            if arrays is not None and f'cross_{key}_rows' in arrays:
+                self.cross[key] = CrossTable(arrays[f'cross_{key}_rows'], arrays[f'cross_{key}_targets'])
+            elif key in self.scorers:
+                self.cross[key] = CrossTable.build(self.scorers[key], src, tgt)
+
+    def snapshot_arrays(self):
+        """
+        Все плотные массивы, нужные для сервинга, по именам файлов снапшота.
+        Fold-in (истории, строки collab, новые пользователи) вливается в сами массивы.
+        """
+        # новые пользователи дописаны в u2b/u2m в порядке индексов
+        idx2ub = self.idx2ub if len(self.u2b) == len(self.idx2ub) else np.array(list(self.u2b))
+        idx2um = self.idx2um if len(self.u2m) == len(self.idx2um) else np.array(list(self.u2m))
+        arrays = {
+            'idx2b': self.idx2b, 'idx2m': self.idx2m, 'idx2ub': idx2ub, 'idx2um': idx2um,
+            'b_mat': self.b_mat, 'm_mat': self.m_mat, 'b_genres': self.b_genres, 'm_genres': self.m_genres,
+            'events_seq': np.array([self.events_seq], dtype=np.int64),
+            'popularity_seq': np.array([self.popularity_seq], dtype=np.int64),
+        }
+        num_users = {'br': len(idx2ub), 'mr': len(idx2um), 'collab_book': len(idx2ub), 'collab_movie': len(idx2um)}
+        for domain, users in self.fresh_users.items():
+            arrays[f'fresh_{domain}'] = np.array(sorted(users), dtype=np.int64)
+        for domain, store in self.topk.items():
+            arrays[f'topk_{domain}_offsets'], arrays[f'topk_{domain}_items'] = store.offsets, store.items
+            arrays[f'topk_{domain}_k'] = np.array([store.top_k], dtype=np.int64)
+        for prefix, index in [('br', self.br_index), ('mr', self.mr_index)]:
+            index = index.merged(num_users[prefix])
+            arrays[f'{prefix}_offsets'] = index.offsets
+            arrays[f'{prefix}_items'] = index.items
+            arrays[f'{prefix}_ratings'] = index.ratings
+        for key, index in self.ivf.items():
+            for name, arr in index.arrays().items():
+                arrays[f'{key}_ivf_{name}'] = arr
+        for key, scorer in self.scorers.items():
+            if isinstance(scorer, CollabScorer):
+                arrays[f'{key}_users'] = scorer.merged_users(num_users[key])
+                arrays[f'{key}_items'] = scorer.item_mat
+            elif isinstance(scorer, ContentScorer):
+                arrays[f'{key}_norms'] = scorer.norms
+                arrays[f'{key}_quality'] = scorer.quality
+            elif isinstance(scorer, DenseTranslator):
+                for name, w in scorer.weights().items():
+                    arrays[f'{key}_{name}'] = w
+        for domain, pop in self.popularity.items():
+            for name, arr in pop.arrays().items():
+                arrays[f'pop_{domain}_{name}'] = arr
+        for key, table in self.cross.items():
+            arrays[f'cross_{key}_rows'] = table.rows
+            arrays[f'cross_{key}_targets'] = table.targets
+        if hasattr(self, 'book_embs'):
+            arrays['book_embs'] = self.book_embs
+            arrays['movie_embs'] = self.movie_embs
+        return arrays
+
+    def save_snapshot(self, root=None):
+        return write_snapshot(root or self.snapshot_dir, self.version, self.snapshot_arrays())
+
+    def checkpoint(self, root=None):
+        """
+        После компакции журнала: новая версия снапшота, куда влиты уже применённые события,
+        с events_seq = applied_seq. Рестарт и соседние воркеры (через CURRENT) переигрывают только
+        хвост после неё. Возвращает новую версию или None, если писать нечего.
+        """
+        root = root or self.snapshot_dir
+        if self.version is None or self.applied_seq <= self.events_seq or current_version(root) != self.version:
+            return None  # CURRENT уже сменил /retrain — этот лоадер устарел
+        # под обеими блокировками: fold-in и счётчики не меняются, пока собираются массивы
+        with self._seq_lock, self._fold_lock:
+            seq = self.applied_seq
+            arrays = self.snapshot_arrays()
+            arrays['events_seq'] = np.array([seq], dtype=np.int64)
+            arrays.update({f'pop_{domain}_{name}': arr.copy()
+                           for domain, pop in self.popularity.items() for name, arr in pop.arrays().items()})
+        version = f"{self.version.split('+')[0]}+{seq}"
+        write_snapshot(root, version, arrays)
+        self.events_seq, self.version = seq, version
+        return version
+
+    def load_topk(self, root=None):
+        """Подхватить предпосчитанные top-K из снапшота этой же версии моделей."""
+        root = root or self.snapshot_dir
+        if current_version(root) != self.version:
+            return
+        _, a = read_snapshot(root, self.version)
+        self._set_topk(a)
+
+    def _set_topk(self, arrays):
+        for domain in ('books', 'movies'):
+            store = TopKStore.from_arrays(arrays, domain)
+            if store is not None:
+                self.topk[domain] = store
+
+    def load_snapshot(self, root=None, version=None, mmap=True):
+        """
+        Сервинг из снапшота: только NumPy, без Keras и пересборки графов.
+        При mmap=True массивы мапятся read-only и общие для всех воркеров.
+        """
+        version, a = read_snapshot(root or self.snapshot_dir, version, mmap=mmap)
+        if version is None:
+            return False
+
+        self.idx2b, self.idx2m, self.idx2ub, self.idx2um = a['idx2b'], a['idx2m'], a['idx2ub'], a['idx2um']
+        self.b2idx = {b: i for i, b in enumerate(self.idx2b.tolist())}
+        self.m2idx = {m: i for i, m in enumerate(self.idx2m.tolist())}
+        self.u2b = {u: i for i, u in enumerate(self.idx2ub.tolist())}
+        self.u2m = {u: i for i, u in enumerate(self.idx2um.tolist())}
+
+        self.br_index = InteractionIndex(a['br_offsets'], a['br_items'], a['br_ratings'])
+        self.mr_index = InteractionIndex(a['mr_offsets'], a['mr_items'], a['mr_ratings'])
+        self.b_mat, self.m_mat = a['b_mat'], a['m_mat']
+        for domain, mat, genres in [('books', self.b_mat, 'b_genres'), ('movies', self.m_mat, 'm_genres')]:
+            setattr(self, genres, a[genres] if genres in a else np.zeros(0, dtype=str))
+            if f'pop_{domain}_count' in a:
+                self.popularity[domain] = Popularity(
+                    *(a[f'pop_{domain}_{name}'] for name in Popularity.ARRAYS),
+                    mat, a[genres].tolist(), Settings.POPULAR_LIST_SIZE,
+                )
+        for key, mat in [('content_book', self.b_mat), ('content_movie', self.m_mat)]:
+            if f'{key}_quality' in a:
+                self.scorers[key] = ContentScorer(mat, a[f'{key}_norms'], a[f'{key}_quality'],
+                                                  Settings.CONTENT_QUALITY_WEIGHT)
+
+        for key in ('collab_book', 'collab_movie'):
+            if f'{key}_users' in a:
+                self.scorers[key] = CollabScorer(a[f'{key}_users'], a[f'{key}_items'])
+            if Settings.COLLAB_IVF and f'{key}_ivf_codes' in a:
+                self.ivf[key] = IVFPQIndex.from_arrays({n: a[f'{key}_ivf_{n}'] for n in IVFPQIndex.ARRAYS})
+
+        for key in ('book2movie', 'movie2book'):
+            if f'{key}_w1' in a:
+                self.scorers[key] = DenseTranslator(*(a[f'{key}_{name}'] for name in DenseTranslator.WEIGHTS))
+        if 'book_embs' in a:
+            self.book_embs, self.movie_embs = a['book_embs'], a['movie_embs']
+            self._build_cross_tables(a)
+            self._load_ann()
 
-            b2m_w = os.path.join(self.out_dir, 'book2movie_weights.h5')
-            if os.path.isfile(b2m_w):
-                t1 = Translator(self.book_embs.shape[1])
-                t1.load_weights(b2m_w)
-                self.models['book2movie'] = t1
-
-            m2b_w = os.path.join(self.out_dir, 'movie2book_weights.h5')
-            if os.path.isfile(m2b_w):
-                t2 = Translator(self.movie_embs.shape[1])
-                t2.load_weights(m2b_w)
-                self.models['movie2book'] = t2
+        self._set_topk(a)
+        self.fresh_users = {d: set(a[f'fresh_{d}'].tolist()) if f'fresh_{d}' in a else set()
+                            for d in self.fresh_users}
+        self.events_seq = self.applied_seq = int(a['events_seq'][0]) if 'events_seq' in a else 0
+        self.popularity_seq = int(a['popularity_seq'][0]) if 'popularity_seq' in a else self.events_seq
+        self.version = version
+        return True
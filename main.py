@@ -1,59 +1,352 @@
 # app/main.py
+import time
+
+IMPORT_STARTED = time.time()
+
+import asyncio
 import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
 from fastapi import FastAPI, HTTPException
-from app.schemas import UserRequest, RecommendationResponse
-from app.train import train_all_models
+from app.schemas import (
+    UserRequest, RecommendationResponse, BatchUserRequest, BatchRecommendationResponse, FusionParams,
+    RatingsRequest, FoldInResponse, EventsRequest, EventsResponse,
+)
 from app.loader import ModelLoader
-from app.recommender import get_all_recommendations
+from app.recommender import (
+    NEEDED_MODELS, get_all_recommendations, get_all_recommendations_async, get_batch_recommendations,
+    get_popular, get_precomputed, has_history,
+)
+from app.settings import Settings
+from app.batcher import MicroBatcher
+from app.cache import RecommendationCache
+from app.fusion import fuse
+from app.jobs import RetrainJob
+from app.snapshot import current_version, memory_usage
 from random import randint
 
 
+logger = logging.getLogger(__name__)
 app = FastAPI()
 loader = ModelLoader()
 #loader.load_all()
+cache = RecommendationCache(max_bytes=Settings.CACHE_MAX_BYTES, ttl=Settings.CACHE_TTL)
+retrain_job = RetrainJob()
+# один поток: переобучение никогда не идёт в два захода одновременно
+retrain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrain")
 
 
-def flatten_recs(recs_dict: dict, domain: str) -> list[int]:
-    """Берем recs_dict, выбираем нужные ключи по domain, складываем в плоский список без дублей."""
-    order = []
-    if domain == "books":
-        keys = ["book_collaborative", "book_content", "movie2book"]
-    else:  # movies
-        keys = ["movie_collaborative", "movie_content", "book2movie"]
-    for k in keys:
-        for item in recs_dict.get(k, []):
-            if item not in order:
-                order.append(item)
-    print(order)
-    return order
+@app.on_event("startup")
+def start_executor():
+    # ограниченный пул под источники рекомендаций, живёт вместе с приложением
+    app.state.executor = ThreadPoolExecutor(max_workers=Settings.RECS_THREADS, thread_name_prefix="recs")
+    app.state.batcher = MicroBatcher(
+        score_batch, Settings.MICROBATCH_MAX, Settings.MICROBATCH_WAIT_MS / 1000, app.state.executor
+    )
+    app.state.rss_at_start = memory_usage()
 
 
-@app.post("/recommend/{domain}", response_model=RecommendationResponse)
-def recommend(domain: str, req: UserRequest):
-    if domain not in ["books", "movies"]:
-        raise HTTPException(400, "Invalid domain")
+def score_batch(group, user_ids):
+    current, domain, top_k = group
+    return get_batch_recommendations(current, user_ids, domain, top_k)
 
-    user_str = str(req.user_id)
 
-    needed = {
-        "books": ["collab_book", "content_book", "movie2book"],
-        "movies": ["collab_movie", "content_movie", "book2movie"]
+def process_started_at():
+    """Момент старта процесса (epoch) по /proc; если его нет — начало импорта main."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        # возраст процесса по /proc/uptime (сотые секунды), а не btime из /proc/stat — тот округлён до секунды
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return IMPORT_STARTED
+
+
+@app.on_event("startup")
+def load_snapshot():
+    # снапшот — чистый NumPy: ни TF, ни pandas на холодном старте не импортируются;
+    # в mmap-режиме все воркеры мапят один и тот же снапшот с диска
+    loader.load_snapshot(mmap=Settings.SERVING_MODE == "mmap")
+    started = process_started_at()
+    app.state.startup = {
+        "import_s": IMPORT_STARTED - started,
+        "ready_s": time.time() - started,
+        "first_recommend_s": None,
     }
-    miss = [m for m in needed[domain] if m not in loader.models]
+
+
+def sync_snapshot(current: ModelLoader):
+    """
+    Новый CURRENT от /retrain в соседнем воркере -> лоадер из этого снапшота (None, если менять нечего).
+    Офлайн top-K дописывается в версию уже после CURRENT — дочитываем его, когда появится.
+    """
+    version = current_version(current.snapshot_dir)
+    if version is None or retrain_job.running:  # свой /retrain подменит лоадер сам
+        return None
+    if version != current.version:
+        fresh = ModelLoader(current.data_dir, current.out_dir)
+        if fresh.load_snapshot(version=version, mmap=Settings.SERVING_MODE == "mmap"):
+            fresh.replay_events()
+            return fresh
+    elif Settings.PRECOMPUTE_TOPK and not current.topk:
+        path = os.path.join(current.snapshot_dir, version)
+        if os.path.isdir(path) and any(f.startswith("topk_") and f.endswith("_k.npy") for f in os.listdir(path)):
+            current.load_topk()
+    return None
+
+
+async def maintain_events():
+    """
+    Подтягиваем новый снапшот и события соседних воркеров, периодически компактим журнал.
+    Воркер, чья компакция что-то перенесла, пишет снапшот с этими событиями (ModelLoader.checkpoint):
+    рестарт и остальные воркеры дальше переигрывают только хвост после него.
+    """
+    global loader
+    loop = asyncio.get_running_loop()
+    last_compact = time.monotonic()
+    while True:
+        await asyncio.sleep(Settings.EVENTS_POLL_S)
+        try:
+            current = loader
+            fresh = await loop.run_in_executor(None, sync_snapshot, current)
+            if fresh is not None:
+                loader = current = fresh
+                cache.clear()
+            for user_id, domain in await loop.run_in_executor(None, current.replay_events):
+                cache.invalidate(user_id, domain)
+            if time.monotonic() - last_compact >= Settings.EVENTS_COMPACT_S:
+                last_compact = time.monotonic()
+                if await loop.run_in_executor(None, current.events.compact) and not retrain_job.running:
+                    for user_id, domain in await loop.run_in_executor(None, current.replay_events):
+                        cache.invalidate(user_id, domain)
+                    if await loop.run_in_executor(None, current.checkpoint):
+                        cache.clear()  # ключи кэша — по версии лоадера
+        except Exception:
+            logger.exception("events maintenance failed")
+
+
+@app.on_event("startup")
+async def start_events():
+    # после load_snapshot: переигрываем только хвост журнала новее снапшота
+    for user_id, domain in loader.replay_events():
+        cache.invalidate(user_id, domain)
+    app.state.events_task = asyncio.create_task(maintain_events())
+
+
+@app.on_event("shutdown")
+def stop_executor():
+    app.state.events_task.cancel()
+    app.state.executor.shutdown(wait=False)
+    retrain_executor.shutdown(wait=False)
+
+
+def fusion_of(req: FusionParams):
+    """(метод, веса) для fuse и ключ кэша; ключ None — запрос на настройках по умолчанию."""
+    method = req.fusion or Settings.FUSION_METHOD
+    weights = {**Settings.FUSION_WEIGHTS, **(req.weights or {})}
+    custom = req.fusion is not None or req.weights is not None
+    return method, weights, (method, tuple(sorted(weights.items()))) if custom else None
+
+
+def fuse_recs(raw: dict, top_k: int, method: str, weights: dict) -> list[int]:
+    """{источник: [Rec, ...]} -> до top_k ID без дублей, один проход по всем источникам."""
+    return fuse(raw, top_k, weights, method, Settings.FUSION_RRF_K)
+
+
+def served(recommendations):
+    # первый успешный ответ для отчёта о старте — из любого пути: популярное, стор, кэш или скоринг
+    if app.state.startup["first_recommend_s"] is None:
+        app.state.startup["first_recommend_s"] = time.time() - process_started_at()
+    return recommendations
+
+
+def check_ready(current: ModelLoader, domain: str):
+    if domain not in NEEDED_MODELS:
+        raise HTTPException(400, "Invalid domain")
+    miss = current.missing(NEEDED_MODELS[domain])
     if miss:
         raise HTTPException(
             503,
             f"Models not ready: {miss}. Call /retrain first."
         )
 
-    raw = get_all_recommendations(loader, req.user_id, domain)
-    flat = flatten_recs(raw, domain)
-    return RecommendationResponse(recommendations=flat)
 
+@app.post("/recommend/{domain}", response_model=RecommendationResponse)
+async def recommend(domain: str, req: UserRequest):
+    # снимок лоадера на весь запрос: /retrain может подменить глобальный в любой момент
+    current = loader
+    check_ready(current, domain)
+
+    # холодный старт: истории нет — всем источникам не из чего считать, отдаём популярное за O(1)
+    if not has_history(current, domain, req.user_id):
+        popular = get_popular(current, domain, req.top_k, Settings.COLD_START_LIST)
+        return RecommendationResponse(recommendations=served(popular or []))
+
+    method, weights, fusion_key = fusion_of(req)
+    # O(1): готовый список из офлайн-стора, если пользователь не действовал после обучения
+    # и не переопределил слияние (стор посчитан с весами по умолчанию)
+    if fusion_key is None:
+        precomputed = get_precomputed(current, req.user_id, domain, req.top_k)
+        if precomputed is not None:
+            return RecommendationResponse(recommendations=served(precomputed))
 
-@app.post("/retrain")
+    key = cache.key(req.user_id, domain, req.top_k, current.version, fusion_key)
+    flat = cache.get(key)
+    if flat is not None:
+        return RecommendationResponse(recommendations=served(flat))
+
+    executor = app.state.executor
+    if Settings.MICROBATCH:
+        # лоадер в группе: запросы до и после /retrain в один батч не попадут
+        raw = await app.state.batcher.submit((current, domain, req.top_k), req.user_id)
+    elif Settings.PARALLEL_SOURCES:
+        raw = await get_all_recommendations_async(current, req.user_id, domain, req.top_k, executor)
+    else:
+        loop = asyncio.get_running_loop()
+        raw = await loop.run_in_executor(executor, get_all_recommendations, current, req.user_id, domain, req.top_k)
+    flat = fuse_recs(raw, req.top_k, method, weights)
+    cache.put(key, flat)
+    return RecommendationResponse(recommendations=served(flat))
+
+
+@app.post("/recommend/{domain}/batch", response_model=BatchRecommendationResponse)
+def recommend_batch(domain: str, req: BatchUserRequest):
+    current = loader
+    check_ready(current, domain)
+
+    method, weights, _ = fusion_of(req)
+    raw = get_batch_recommendations(current, req.user_ids, domain, req.top_k)
+    popular = get_popular(current, domain, req.top_k, Settings.COLD_START_LIST) or []
+    return BatchRecommendationResponse(
+        recommendations=served({
+            u: fuse_recs(recs, req.top_k, method, weights) if has_history(current, domain, u) else popular
+            for u, recs in raw.items()
+        })
+    )
+
+
+@app.get("/popular/{domain}", response_model=RecommendationResponse)
+def popular(domain: str, top_k: int = 10, kind: str = "trending", genre: Optional[str] = None):
+    if domain not in NEEDED_MODELS:
+        raise HTTPException(400, "Invalid domain")
+    if kind not in ("trending", "global"):
+        raise HTTPException(400, "kind must be 'trending' or 'global'")
+    recs = get_popular(loader, domain, top_k, kind, genre)
+    if recs is None:
+        raise HTTPException(503, "Popularity model not ready. Call /retrain first.")
+    return RecommendationResponse(recommendations=recs)
+
+
+@app.post("/ratings/{domain}", response_model=FoldInResponse)
+def add_ratings(domain: str, req: RatingsRequest):
+    """
+    Новые оценки пользователя учитываются сразу: fold-in его строки вместо /retrain.
+    Пишутся в журнал, как /events, — их подхватят соседние воркеры, рестарт и /retrain.
+    """
+    current = loader
+    check_ready(current, domain)
+    t0 = time.perf_counter()
+    ratings = {r.item_id: r.rating for r in req.ratings}
+    user2idx, item2idx = (current.u2b, current.b2idx) if domain == "books" else (current.u2m, current.m2idx)
+    new_user = req.user_id not in user2idx
+    accepted = sum(item_id in item2idx for item_id in ratings)
+    if ratings:
+        n = len(ratings)
+        events = current.events.append([domain] * n, ["rating"] * n, [req.user_id] * n,
+                                       list(ratings), list(ratings.values()), [time.time()] * n)
+        for user_id, d in current.apply_appended(events):
+            cache.invalidate(user_id, d)
+    return FoldInResponse(user_id=req.user_id, accepted=accepted, new_user=new_user and accepted > 0,
+                          took_ms=(time.perf_counter() - t0) * 1e3)
+
+
+@app.post("/events", response_model=EventsResponse)
+def ingest_events(req: EventsRequest):
+    """Пачка оценок/избранного: в журнал на диске и сразу в индексы текущего лоадера."""
+    ratings = []
+    for e in req.events:
+        rating = Settings.FAVOURITE_RATING if e.kind == "favourite" else e.rating
+        if rating is None:
+            raise HTTPException(422, f"Rating event without rating: user {e.user_id}, item {e.item_id}")
+        ratings.append(rating)
+    if not ratings:
+        return EventsResponse(accepted=0, last_seq=None)
+    now = time.time()
+    current = loader
+    events = current.events.append(
+        [e.domain for e in req.events], [e.kind for e in req.events],
+        [e.user_id for e in req.events], [e.item_id for e in req.events],
+        ratings, [e.timestamp or now for e in req.events],
+    )
+    for user_id, domain in current.apply_appended(events):
+        cache.invalidate(user_id, domain)
+    return EventsResponse(accepted=len(events), last_seq=int(events["seq"][-1]))
+
+
+def run_retrain():
+    """Обучаем и собираем новый лоадер в стороне, затем публикуем его одной заменой ссылки."""
+    global loader
+    # обучение тянет TensorFlow — импортируем только когда /retrain реально вызван
+    from app.train import train_all_models, STAGES
+    from app.precompute import precompute_topk
+
+    total = len(STAGES) + 2  # + загрузка нового лоадера и офлайн top-K
+    try:
+        train_all_models(progress=lambda stage, done, _: retrain_job.progress(stage, done, total))
+        retrain_job.progress("load", len(STAGES), total)
+        fresh = ModelLoader(loader.data_dir, loader.out_dir)
+        fresh.load_all()
+        fresh.save_snapshot()
+        if Settings.PRECOMPUTE_TOPK:
+            retrain_job.progress("precompute", len(STAGES) + 1, total)
+            precompute_topk(fresh.out_dir, workers=Settings.PRECOMPUTE_WORKERS)
+        if Settings.SERVING_MODE == "mmap":
+            fresh = ModelLoader(loader.data_dir, loader.out_dir)
+            fresh.load_snapshot()
+        else:
+            fresh.load_topk()
+        fresh.replay_events()  # события, пришедшие, пока шло обучение
+        loader = fresh
+        cache.clear()
+        retrain_job.finish()
+    except Exception as e:
+        retrain_job.fail(e)
+
+
+@app.post("/retrain", status_code=202)
 def retrain():
-    train_all_models()
-    loader.load_all()
-    return {"status": "retrained and loaded"}
+    if not retrain_job.try_start():
+        raise HTTPException(409, "Retrain is already running")
+    retrain_executor.submit(run_retrain)
+    return {"status": "started"}
+
+
+@app.get("/stats")
+def stats():
+    return {
+        "serving_mode": Settings.SERVING_MODE,
+        "model_version": loader.version,
+        "memory_at_start": app.state.rss_at_start,
+        "memory": memory_usage(),
+        "startup": app.state.startup,
+    }
+
+
+@app.get("/retrain/status")
+def retrain_status():
+    return {**retrain_job.snapshot(), "model_version": loader.version}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {**cache.stats(), "model_version": loader.version}
+
+
+@app.get("/batcher/stats")
+def batcher_stats():
+    return app.state.batcher.stats()
@@ -0,0 +1,78 @@
+import numpy as np
+
+# Популярность для холодного старта: пользователи без истории получают готовый список за O(1).
+#
+# total — сумма оценок айтема (учитывает и число оценок, и их величину);
+# trend — та же сумма с экспоненциальным затуханием по времени (период полураспада half_life).
+# trend хранится в масштабе момента t_ref: вместо того чтобы затухать всё остальное,
+# новое событие входит с весом 2^((ts - t_ref) / half_life). Порядок от масштаба не зависит.
+
+
+def _top(scores, n):
+    n = min(n, int(np.isfinite(scores).sum()))
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, n - 1)[:n]
+    return part[np.argsort(-scores[part], kind='stable')]
+
+
+class Popularity:
+    ARRAYS = ('count', 'total', 'trend', 'meta')
+
+    def __init__(self, count, total, trend, meta, genre_mat=None, genre_names=(), list_size=100):
+        # копии: счётчики дописываются событиями, а из снапшота приходят read-only mmap
+        self.count = np.array(count, dtype=np.float64)
+        self.total = np.array(total, dtype=np.float64)
+        self.trend = np.array(trend, dtype=np.float64)
+        self.meta = np.array(meta, dtype=np.float64)  # [t_ref, half_life секунд]
+        self.genre_mat = genre_mat
+        self.genre_names = list(genre_names)
+        self.list_size = list_size
+        self.refresh()
+
+    @classmethod
+    def from_ratings(cls, items, ratings, timestamps, n_items, half_life, genre_mat=None, genre_names=(),
+                     list_size=100):
+        """timestamps: секунды epoch или None, если в выгрузке нет колонки timestamp."""
+        ratings = np.asarray(ratings, dtype=np.float64)
+        count = np.bincount(items, minlength=n_items).astype(np.float64)
+        total = np.bincount(items, weights=ratings, minlength=n_items)
+        if timestamps is None or not len(timestamps):
+            t_ref, trend = 0.0, total.copy()
+        else:
+            t_ref = float(np.max(timestamps))
+            w = np.exp2((np.asarray(timestamps, dtype=np.float64) - t_ref) / half_life)
+            trend = np.bincount(items, weights=ratings * w, minlength=n_items)
+        return cls(count, total, trend, [t_ref, half_life], genre_mat, genre_names, list_size)
+
+    def add(self, items, ratings, timestamps):
+        """Инкрементальное обновление счётчиков событиями; списки пересчитывает refresh()."""
+        items = np.asarray(items, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        ts = np.asarray(timestamps, dtype=np.float64)
+        t_ref, half_life = self.meta
+        if t_ref == 0.0 or (ts.max() - t_ref) / half_life > 32:
+            # переносим t_ref к новым событиям, пока веса не ушли за пределы float;
+            # t_ref == 0 — в выгрузке не было времени, старые оценки считаем сделанными сейчас
+            new_ref = float(ts.max())
+            self.trend *= np.exp2((t_ref - new_ref) / half_life) if t_ref else 1.0
+            self.meta[0] = t_ref = new_ref
+        np.add.at(self.count, items, 1.0)
+        np.add.at(self.total, items, ratings)
+        np.add.at(self.trend, items, ratings * np.exp2((ts - t_ref) / half_life))
+
+    def refresh(self):
+        n = self.list_size
+        self.lists = {'global': _top(self.total, n), 'trending': _top(self.trend, n)}
+        self.by_genre = {}
+        if self.genre_mat is not None:
+            for g, name in enumerate(self.genre_names):
+                self.by_genre[name] = _top(np.where(self.genre_mat[:, g] > 0, self.total, -np.inf), n)
+
+    def top(self, k, kind='trending', genre=None):
+        """Индексы айтемов; O(k) — списки уже посчитаны."""
+        lst = self.by_genre.get(genre) if genre is not None else self.lists.get(kind)
+        return lst[:k] if lst is not None else np.empty(0, dtype=np.int64)
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
@@ -0,0 +1,74 @@
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from app.fusion import fuse
+from app.loader import ModelLoader
+from app.recommender import NEEDED_MODELS, get_batch_recommendations
+from app.settings import Settings
+from app.snapshot import current_version
+
+# Офлайн-стадия после обучения: top-K для каждого пользователя из u2b/u2m.
+# Результат лежит в каталоге версии снапшота рядом с моделями, из которых посчитан:
+#   topk_<domain>_offsets.npy  — int64, offsets[u]:offsets[u + 1] по индексу пользователя
+#   topk_<domain>_items.npy    — ID рекомендованных айтемов подряд (слияние с весами из Settings)
+#   topk_<domain>_k.npy        — [top_k]; пишется последним и означает, что стор целиком готов
+
+_worker_loader = None
+
+
+def _save(path, name, arr):
+    # через временный файл: воркеры могут читать каталог версии в этот же момент
+    tmp = os.path.join(path, f'{name}.npy.tmp')
+    with open(tmp, 'wb') as f:
+        np.save(f, arr, allow_pickle=False)
+    os.replace(tmp, os.path.join(path, f'{name}.npy'))
+
+
+def _init_worker(out_dir, version):
+    # каждый процесс мапит тот же снапшот — веса не копируются и не пиклятся
+    global _worker_loader
+    _worker_loader = ModelLoader(out_dir=out_dir)
+    _worker_loader.load_snapshot(version=version)
+
+
+def _score_block(domain, top_k, user_ids):
+    recs = get_batch_recommendations(_worker_loader, user_ids, domain, top_k)
+    lists = [fuse(recs[u], top_k, Settings.FUSION_WEIGHTS, Settings.FUSION_METHOD, Settings.FUSION_RRF_K)
+             for u in user_ids]
+    flat = [i for l in lists for i in l]
+    return np.array([len(l) for l in lists], dtype=np.int64), np.array(flat) if flat else np.zeros(0, np.int64)
+
+
+def precompute_topk(out_dir='outputs', top_k=10, workers=None, block=2048):
+    """Считает top-K всех пользователей блоками в пуле процессов и дописывает стор в текущий снапшот."""
+    loader = ModelLoader(out_dir=out_dir)
+    version = current_version(loader.snapshot_dir)
+    if version is None or not loader.load_snapshot(version=version):
+        return None
+    path = os.path.join(loader.snapshot_dir, version)
+
+    # spawn, а не fork: родитель после обучения держит инициализированный TensorFlow
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(out_dir, version)) as pool:
+        for domain, idx2user in [('books', loader.idx2ub), ('movies', loader.idx2um)]:
+            if loader.missing(NEEDED_MODELS[domain]):
+                continue
+            blocks = [idx2user[s:s + block].tolist() for s in range(0, len(idx2user), block)]
+            parts = list(pool.map(partial(_score_block, domain, top_k), blocks))
+            lengths = np.concatenate([p[0] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+            items = np.concatenate([p[1] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            _save(path, f'topk_{domain}_items', items)
+            _save(path, f'topk_{domain}_offsets', offsets)
+            _save(path, f'topk_{domain}_k', np.array([top_k], dtype=np.int64))
+    return version
+
+
+if __name__ == '__main__':
+    precompute_topk()
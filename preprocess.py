@@ -0,0 +1,180 @@
+import os
+import pickle
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.columnar import TABLES, is_fresh, read_arrays, read_frame, write_dataset
+from app.events import EventLog
+from app.interactions import InteractionIndex
+
+# Общая подготовка выгрузки для обучения (app.train) и сервинга (ModelLoader.load_all).
+# Каждая таблица читается один раз, колонки нормализуются, поверх накладывается компакция
+# журнала событий, и на домен строится единый индекс пользователей/айтемов — по нему
+# обучаются collab, content, skipgram и translator и по нему же их читает лоадер.
+# Итог подготовки, на которой шло обучение, сохраняется рядом с весами (<out_dir>/prepared):
+# load_all берёт его, а не готовит заново — журнал мог уйти в компакцию, и индексы бы разъехались.
+
+PREPARED = 'prepared'
+DOMAINS = {  # домен -> (таблица оценок, таблица айтемов, колонка ID айтема, префикс массивов)
+    'books': ('book_ratings', 'books', 'book_id', 'b'),
+    'movies': ('movie_ratings', 'movies', 'movie_id', 'm'),
+}
+# колонки выгрузки, которые реально нужны (сравниваются без учёта регистра и '_')
+COLUMNS = {
+    'book_ratings': ['user_id', 'book_id', 'rating', 'timestamp'],
+    'movie_ratings': ['user_id', 'movie_id', 'rating', 'timestamp'],
+    'books': ['id', 'book_id', 'genres', 'genre'],
+    'movies': ['id', 'movie_id', 'genres', 'genre'],
+}
+
+
+def normalize_ratings(df):
+    df.columns = [c.lower() for c in df.columns]
+    rename = {}
+    for old, new in [('userid', 'user_id'), ('bookid', 'book_id'), ('movieid', 'movie_id')]:
+        if old in df.columns:
+            rename[old] = new
+    return df.rename(columns=rename) if rename else df
+
+
+def normalize_items(df, item_col):
+    """Колонки в нижний регистр, genre -> genres, id / bookid / movieid -> <домен>_id."""
+    df.columns = [c.lower() for c in df.columns]
+    rename = {}
+    if 'genre' in df.columns and 'genres' not in df.columns:
+        rename['genre'] = 'genres'
+    if item_col not in df.columns:
+        for alias in (item_col.replace('_', ''), 'id'):
+            if alias in df.columns:
+                rename[alias] = item_col
+                break
+    return df.rename(columns=rename) if rename else df
+
+
+def read_tables(data_dir, columns=COLUMNS):
+    """
+    Выгрузка из БД: колоночный снапшот через mmap и только нужные колонки, если он собран
+    из тех же CSV; иначе разбираем CSV один раз и пишем снапшот для следующих загрузок.
+    """
+    import pandas as pd
+    if is_fresh(data_dir):
+        return {t: read_frame(data_dir, t, columns[t]) for t in TABLES}
+    paths = {t: os.path.join(data_dir, fname) for t, fname in TABLES.items()}
+    if not (os.path.isfile(paths['book_ratings']) and os.path.isfile(paths['movie_ratings'])):
+        return None  # не выгружено из БД ещё
+    frames = {t: pd.read_csv(path, low_memory=False) for t, path in paths.items()}
+    write_dataset(data_dir, frames)
+    return frames
+
+
+def with_events(df, compacted, item_col):
+    """
+    Компакция журнала поверх выгрузки: последняя оценка пары побеждает. Возвращает (df, seq).
+    Переоценённые пары меняются на месте, новые дописываются в конец: порядок первого появления,
+    а с ним и индексы build_index у уже известных пользователей и айтемов, не сдвигается.
+    """
+    import pandas as pd
+    if compacted is None or not len(compacted['seq']):
+        return df, 0
+    ev = pd.DataFrame({'user_id': compacted['user_id'], item_col: compacted['item_id'],
+                       'rating': compacted['rating']})
+    if 'timestamp' in df.columns:
+        ev['timestamp'] = pd.to_datetime(compacted['ts'], unit='s')
+    keys = pd.MultiIndex.from_frame(df[['user_id', item_col]])
+    ev_keys = pd.MultiIndex.from_frame(ev[['user_id', item_col]])
+    pos = ev_keys.get_indexer(keys)  # строка компакции для каждой строки выгрузки, -1 — не переоценена
+    hit = pos >= 0
+    if hit.any():
+        df = df.copy()
+        update = ev.iloc[pos[hit]].set_axis(df.index[hit])
+        for col in ev.columns.drop(['user_id', item_col]):
+            df[col] = df[col].where(~hit, update[col])
+    new = ev[~ev_keys.isin(keys)]
+    merged = pd.concat([df, new], ignore_index=True) if len(new) else df
+    return merged, int(compacted['seq'].max())
+
+
+def build_index(ratings, item_col):
+    """Канонический индекс домена: пользователи и айтемы в порядке первого появления в оценках."""
+    users = ratings.user_id.unique()
+    items = ratings[item_col].unique()
+    return {u: i for i, u in enumerate(users.tolist())}, {it: i for i, it in enumerate(items.tolist())}
+
+
+def genre_matrix(items_df, item2idx, item_col, genres_col='genres'):
+    """
+    То же, что models.content.build_genre_matrix, но без iterrows:
+    (items × genres float32, имена жанров в порядке столбцов).
+    """
+    if genres_col not in items_df.columns:
+        return np.zeros((len(item2idx), 0), dtype=np.float32), np.zeros(0, dtype=str)
+    dummies = items_df[genres_col].astype(object).str.get_dummies(sep='|')  # столбцы уже отсортированы
+    rows = items_df[item_col].map(item2idx).to_numpy(dtype=np.float64)
+    known = ~np.isnan(rows)
+    mat = np.zeros((len(item2idx), dummies.shape[1]), dtype=np.float32)
+    np.maximum.at(mat, rows[known].astype(np.int64), dummies.to_numpy(dtype=np.float32)[known])
+    return mat, np.array(list(dummies.columns), dtype=str)
+
+
+def prepare(data_dir='data', events=None):
+    """
+    {домен: SimpleNamespace(ratings, items, item_col, user2idx, item2idx, idx2user, idx2item,
+                            index, genre_mat, genres)} и events_seq — последнее учтённое событие журнала.
+    None, если выгрузки ещё нет.
+    """
+    tables = read_tables(data_dir)
+    if tables is None:
+        return None
+    events = events or EventLog(os.path.join(data_dir, 'events'))
+    # жанровые матрицы выровнены по индексу айтемов: берём из снапшота, если индекс тот же
+    cached = read_arrays(data_dir, [name for *_, p in DOMAINS.values() for name in (f'idx2{p}', f'{p}_mat', f'{p}_genres')])
+    fresh = {}
+    out = SimpleNamespace(events_seq=0)
+    for domain, (ratings_table, items_table, item_col, prefix) in DOMAINS.items():
+        ratings, seq = with_events(normalize_ratings(tables[ratings_table]), events.compacted(domain), item_col)
+        out.events_seq = max(out.events_seq, seq)
+        items = normalize_items(tables[items_table], item_col)
+        user2idx, item2idx = build_index(ratings, item_col)
+        idx2user, idx2item = np.array(list(user2idx)), np.array(list(item2idx))
+
+        if f'{prefix}_mat' in cached and np.array_equal(cached[f'idx2{prefix}'], idx2item):
+            mat, genres = cached[f'{prefix}_mat'].astype(np.float32), cached[f'{prefix}_genres']
+        else:
+            mat, genres = genre_matrix(items, item2idx, item_col)
+            fresh.update({f'idx2{prefix}': idx2item, f'{prefix}_mat': mat.astype(np.uint8),
+                          f'{prefix}_genres': genres})
+
+        setattr(out, domain, SimpleNamespace(
+            ratings=ratings, items=items, item_col=item_col,
+            user2idx=user2idx, item2idx=item2idx, idx2user=idx2user, idx2item=idx2item,
+            # CSR-индекс историй, чтобы не сканировать рейтинги на каждый запрос
+            index=InteractionIndex.from_ratings(ratings, user2idx, item2idx, item_col),
+            genre_mat=mat, genres=genres,
+        ))
+    if fresh:
+        write_dataset(data_dir, arrays=fresh)
+    return out
+
+
+def save_prepared(data, path):
+    """Результат prepare по доменам в <path>/<домен>.pkl; events_seq пишется последним — признак целого."""
+    os.makedirs(path, exist_ok=True)
+    for domain in DOMAINS:
+        with open(os.path.join(path, f'{domain}.pkl'), 'wb') as f:
+            pickle.dump(getattr(data, domain), f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(path, 'events_seq'), 'w') as f:
+        f.write(str(data.events_seq))
+
+
+def load_prepared(path):
+    """Сохранённый save_prepared результат или None, если его нет."""
+    try:
+        with open(os.path.join(path, 'events_seq')) as f:
+            out = SimpleNamespace(events_seq=int(f.read()))
+    except FileNotFoundError:
+        return None
+    for domain in DOMAINS:
+        with open(os.path.join(path, f'{domain}.pkl'), 'rb') as f:
+            setattr(out, domain, pickle.load(f))
+    return out
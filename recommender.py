@@ -1,58 +1,208 @@
+import asyncio
+from functools import partial
+from types import SimpleNamespace
+
 import numpy as np
-import pandas as pd
-import tensorflow as tf
 
-from models.collaborative import build_collab_model, build_mappings as collab_maps
-from models.content import load_items, build_genre_matrix, build_content_model
-from models.translator import Translator
+from app.fusion import to_recs
+from app.scoring import CollabScorer, ContentScorer, select_top_k, select_top_k_rows
+from app.interactions import InteractionIndex
+from app.settings import Settings
+
+def get_interacted(index: InteractionIndex, user2idx, user_id):
+    if user_id not in user2idx:
+        return np.empty(0, dtype=np.int32)
+    return index.items_of(user2idx[user_id])
 
-def get_interacted(df, item2idx, user_id):
-    col = 'book_id' if 'book_id' in df.columns else 'movie_id'
-    return df[df.user_id == user_id][col].map(item2idx).dropna().astype(int).tolist()
+def get_ratings(index: InteractionIndex, user2idx, user_id):
+    if user_id not in user2idx:
+        return np.empty(0, dtype=np.float32)
+    return index.history(user2idx[user_id])[1]
 
-def predict_cross(src_embs, tgt_embs, translator, interacted_ids, top_k=10):
-    if not interacted_ids:
+def predict_cross(src_embs, tgt_embs, translator, interacted_ids, idx2item, top_k=10, ann=None,
+                  table=None, weights=None):
+    if len(interacted_ids) == 0:
         return []
-    avg = src_embs[interacted_ids].mean(axis=0, keepdims=True)
-    proj = translator(avg).numpy()  # shape: (1, D)
-    sims = proj @ tgt_embs.T        # cosine sim можно позже
-    top = np.argsort(sims[0])[-top_k:][::-1]
-    return top.tolist()  # возвращаем индексы — будет превращено в ID выше
+    if table is not None:
+        # перевод сделан при загрузке: запрос — взвешенное среднее готовых строк, скор — косинус
+        proj = table.queries([interacted_ids], [weights])
+        tgt_embs = table.targets
+    else:
+        avg = src_embs[interacted_ids].mean(axis=0, keepdims=True)
+        proj = np.asarray(translator(avg))  # shape: (1, D)
+    if ann is not None:
+        top, scores = ann.knn(proj, top_k)  # HNSW вместо полного скана tgt_embs
+        top, scores = top[0], scores[0]
+    else:
+        sims = proj @ tgt_embs.T        # cosine sim можно позже
+        top, scores = select_top_k(sims[0], top_k)
+    return to_recs(idx2item[top], scores, 'cross')
 
-def predict_collab(model, user2idx, item2idx, user_id, top_k=10):
+def predict_collab(scorer: CollabScorer, user2idx, idx2item, user_id, top_k=10, exclude=None,
+                   ivf=None, nprobe=16, rerank=10):
     if user_id not in user2idx:
         return []
     uid = user2idx[user_id]
-    all_items = np.arange(len(item2idx))
-    users = np.full_like(all_items, uid)
-    preds = model.predict([users, all_items], verbose=0)
-    top = np.argsort(preds[:, 0])[-top_k:][::-1]
-    return [list(item2idx.keys())[i] for i in top]
-
-def predict_content(model, mat, ratings_df, item2idx, user_id, top_k=10):
-    if user_id not in ratings_df.user_id.values:
-        return []
-    col = 'book_id' if 'book_id' in ratings_df.columns else 'movie_id'
-    items = ratings_df[ratings_df.user_id == user_id][col].map(item2idx).dropna().astype(int).tolist()
-    if not items:
+    if ivf is None:
+        preds = scorer.score(uid)
+        top, scores = select_top_k(preds, top_k, exclude)
+        return to_recs(idx2item[top], scores, 'collab')
+
+    # приближённый режим: кандидаты из IVF-PQ с запасом под исключения, затем точный пересчёт
+    n_excl = 0 if exclude is None else len(exclude)
+    cand, approx = ivf.search(scorer.user_row(uid), (top_k + n_excl) * max(rerank, 1), nprobe)
+    preds = scorer.score_items(uid, cand) if rerank else approx
+    mask = np.isin(cand, exclude) if n_excl else None
+    top, scores = select_top_k(preds, top_k, mask)
+    return to_recs(idx2item[cand[top]], scores, 'collab')
+
+def predict_content(scorer: ContentScorer, index, user2idx, idx2item, user_id, top_k=10, exclude=None):
+    items = get_interacted(index, user2idx, user_id)
+    if len(items) == 0:
         return []
-    avg_feat = mat[items].mean(axis=0, keepdims=True)
-    preds = model.predict(np.repeat(avg_feat, len(item2idx), axis=0), verbose=0).flatten()
-    top = np.argsort(preds)[-top_k:][::-1]
-    return [list(item2idx.keys())[i] for i in top]
+    preds = scorer.score(items)
+    top, scores = select_top_k(preds, top_k, exclude)
+    return to_recs(idx2item[top], scores, 'content')
 
-def get_all_recommendations(loader, user_id: int, domain: str, top_k: int = 10):
-    # collaborative
-    if domain == 'books':
-        collab = predict_collab(loader.models['collab_book'], loader.u2b, loader.b2idx, user_id, top_k)
-        cont = predict_content(loader.models['content_book'], loader.b_mat, loader.df_br, loader.b2idx, user_id, top_k)
-        movie_rec = predict_cross(loader.book_embs, loader.movie_embs, loader.models['book2movie'],
-                                  get_interacted(loader.df_br, loader.b2idx, user_id), top_k)
-        return collab + cont + movie_rec
+NEEDED_MODELS = {
+    "books": ["collab_book", "content_book", "movie2book"],
+    "movies": ["collab_movie", "content_movie", "book2movie"]
+}
+
+def get_precomputed(loader, user_id: int, domain: str, top_k: int = 10):
+    """Готовый top-K из офлайн-стора или None, если его нет / он устарел для этого пользователя."""
+    store = loader.topk.get(domain)
+    if store is None or store.top_k != top_k or user_id in loader.fresh_users[domain]:
+        return None
+    user2idx = loader.u2b if domain == 'books' else loader.u2m
+    if user_id not in user2idx:
+        return None
+    return store.get(user2idx[user_id])
+
+def has_history(loader, domain: str, user_id: int):
+    index, user2idx = (loader.br_index, loader.u2b) if domain == 'books' else (loader.mr_index, loader.u2m)
+    return user_id in user2idx and len(index.items_of(user2idx[user_id])) > 0
+
+def get_popular(loader, domain: str, top_k: int = 10, kind: str = 'trending', genre=None):
+    """Готовый список популярного (global / trending / по жанру) или None, если модели популярности нет."""
+    pop = loader.popularity.get(domain)
+    if pop is None:
+        return None
+    idx2item = loader.idx2b if domain == 'books' else loader.idx2m
+    return idx2item[pop.top(top_k, kind, genre)].tolist()
 
+def domain_view(loader, domain: str):
+    """Всё, что нужно предикторам для одного домена, собранное в одном месте."""
+    if domain == 'books':
+        return SimpleNamespace(
+            scorer=loader.scorers['collab_book'], ivf=loader.ivf.get('collab_book'),
+            content=loader.scorers['content_book'],
+            index=loader.br_index, user2idx=loader.u2b, idx2item=loader.idx2b,
+            src_embs=loader.book_embs, tgt_embs=loader.movie_embs, translator=loader.scorers['book2movie'],
+            table=loader.cross.get('book2movie'), idx2tgt=loader.idx2m, ann=loader.ann.get('movie'),
+        )
     elif domain == 'movies':
-        collab = predict_collab(loader.models['collab_movie'], loader.u2m, loader.m2idx, user_id, top_k)
-        cont = predict_content(loader.models['content_movie'], loader.m_mat, loader.df_mr, loader.m2idx, user_id, top_k)
-        book_rec = predict_cross(loader.movie_embs, loader.book_embs, loader.models['movie2book'],
-                                 get_interacted(loader.df_mr, loader.m2idx, user_id), top_k)
-        return collab + cont + book_rec
+        return SimpleNamespace(
+            scorer=loader.scorers['collab_movie'], ivf=loader.ivf.get('collab_movie'),
+            content=loader.scorers['content_movie'],
+            index=loader.mr_index, user2idx=loader.u2m, idx2item=loader.idx2m,
+            src_embs=loader.movie_embs, tgt_embs=loader.book_embs, translator=loader.scorers['movie2book'],
+            table=loader.cross.get('movie2book'), idx2tgt=loader.idx2b, ann=loader.ann.get('book'),
+        )
+    raise ValueError(f'Unknown domain: {domain}')
+
+def _sources(d, user_id, top_k, seen):
+    # три независимых источника: collab, content, cross — порядок задаёт приоритет при равных скорах в fuse
+    return [
+        partial(predict_collab, d.scorer, d.user2idx, d.idx2item, user_id, top_k, seen,
+                d.ivf, Settings.IVF_NPROBE, Settings.IVF_RERANK),
+        partial(predict_content, d.content, d.index, d.user2idx, d.idx2item, user_id, top_k, seen),
+        partial(predict_cross, d.src_embs, d.tgt_embs, d.translator, seen, d.idx2tgt, top_k, d.ann,
+                d.table, get_ratings(d.index, d.user2idx, user_id) if d.table is not None else None),
+    ]
+
+def get_all_recommendations(loader, user_id: int, domain: str, top_k: int = 10, executor=None):
+    """
+    С executor источники считаются параллельно: NumPy/TF отпускают GIL.
+    Возвращает {источник: [Rec, ...]} — сливает их app.fusion.fuse.
+    """
+    d = domain_view(loader, domain)
+    seen = get_interacted(d.index, d.user2idx, user_id)
+    calls = _sources(d, user_id, top_k, seen)
+    if executor is None:
+        collab, cont, cross = [call() for call in calls]
+    else:
+        collab, cont, cross = [f.result() for f in [executor.submit(call) for call in calls]]
+    return {'collab': collab, 'content': cont, 'cross': cross}
+
+async def get_all_recommendations_async(loader, user_id: int, domain: str, top_k: int = 10, executor=None):
+    """Вариант для async-эндпоинта: источники уходят в executor, event loop не блокируется."""
+    loop = asyncio.get_running_loop()
+    d = domain_view(loader, domain)
+    seen = get_interacted(d.index, d.user2idx, user_id)
+    collab, cont, cross = await asyncio.gather(
+        *(loop.run_in_executor(executor, call) for call in _sources(d, user_id, top_k, seen))
+    )
+    return {'collab': collab, 'content': cont, 'cross': cross}
+
+def _block_rows(n_items, budget_bytes=64 << 20):
+    # сколько пользователей влезает в блок скоров float32 заданного размера
+    return max(1, budget_bytes // (4 * max(n_items, 1)))
+
+def _rows_to_recs(idx, scores, idx2item, source):
+    return [to_recs(idx2item[i[s > -np.inf]], s[s > -np.inf], source) for i, s in zip(idx, scores)]
+
+def get_batch_recommendations(loader, user_ids, domain: str, top_k: int = 10):
+    """
+    То же, что get_all_recommendations, но для пачки пользователей:
+    collab — блочное умножение матриц, cross — один вызов переводчика на всех.
+    content — одно матричное умножение профилей на жанровую матрицу.
+    Возвращает {user_id: {источник: [Rec, ...]}}.
+    """
+    d = domain_view(loader, domain)
+    known = [u for u in dict.fromkeys(user_ids) if u in d.user2idx]
+    uidx = np.array([d.user2idx[u] for u in known], dtype=np.int64)
+    seen = [d.index.items_of(i) for i in uidx]
+
+    collab = []
+    step = _block_rows(d.scorer.num_items)
+    for start in range(0, len(known), step):
+        block = uidx[start:start + step]
+        idx, scores = select_top_k_rows(d.scorer.score_batch(block), top_k, seen[start:start + step])
+        collab.extend(_rows_to_recs(idx, scores, d.idx2item, 'collab'))
+
+    cont = [[] for _ in known]
+    cross = [[] for _ in known]
+    with_history = [j for j, s in enumerate(seen) if len(s)]
+    step = _block_rows(d.content.mat.shape[0])
+    for start in range(0, len(with_history), step):
+        rows = with_history[start:start + step]
+        scores = d.content.score_profiles(d.content.profiles([seen[j] for j in rows]))
+        idx, scores = select_top_k_rows(scores, top_k, [seen[j] for j in rows])
+        for j, recs in zip(rows, _rows_to_recs(idx, scores, d.idx2item, 'content')):
+            cont[j] = recs
+
+    if with_history:
+        tgt_embs = d.tgt_embs
+        if d.table is not None:
+            proj = d.table.queries([seen[j] for j in with_history],
+                                   [d.index.history(uidx[j])[1] for j in with_history])
+            tgt_embs = d.table.targets
+        else:
+            avgs = np.stack([d.src_embs[seen[j]].mean(axis=0) for j in with_history])
+            proj = np.asarray(d.translator(avgs))
+        if d.ann is not None:
+            idx, scores = d.ann.knn(proj, top_k)
+            for j, row, sc in zip(with_history, idx, scores):
+                cross[j] = to_recs(d.idx2tgt[row], sc, 'cross')
+        else:
+            step = _block_rows(tgt_embs.shape[0])
+            for start in range(0, len(with_history), step):
+                idx, scores = select_top_k_rows(proj[start:start + step] @ tgt_embs.T, top_k)
+                for j, recs in zip(with_history[start:start + step], _rows_to_recs(idx, scores, d.idx2tgt, 'cross')):
+                    cross[j] = recs
+
+    result = {u: {} for u in user_ids}
+    for j, u in enumerate(known):
+        result[u] = {'collab': collab[j], 'content': cont[j], 'cross': cross[j]}
+    return result
@@ -0,0 +1,98 @@
+import numpy as np
+
+# Обучающие пары skipgram без циклов по пользователям: последовательность пользователя —
+# его оценки в порядке выгрузки, контекст айтема — соседи на расстоянии 1..window.
+# Негативы — из униграммного распределения в степени 0.75 (как в word2vec) через alias-таблицу.
+
+
+class UnigramSampler:
+    """
+    Alias-таблица (Vose) над частотами айтемов в степени power: строится один раз на словарь,
+    выборка любого размера — два равномерных числа и gather на элемент, без цикла.
+    """
+    def __init__(self, prob, alias):
+        self.prob = prob    # float32: вероятность оставить ячейку i, иначе берём alias[i]
+        self.alias = alias  # int32
+
+    @classmethod
+    def from_counts(cls, counts, power=0.75):
+        weights = np.asarray(counts, dtype=np.float64) ** power
+        n = len(weights)
+        scaled = (weights * n / weights.sum()).tolist()
+        prob = np.ones(n, dtype=np.float32)
+        alias = np.arange(n, dtype=np.int32)
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] += scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        return cls(prob, alias)  # остатки — ячейки с вероятностью 1 (погрешность округления)
+
+    @classmethod
+    def from_items(cls, items, vocab_size, power=0.75):
+        """items — индексы айтемов всех оценок."""
+        return cls.from_counts(np.bincount(items, minlength=vocab_size), power)
+
+    def sample(self, shape, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
+        i = rng.integers(0, len(self.prob), shape, dtype=np.int32)
+        return np.where(rng.random(shape, dtype=np.float32) < self.prob[i], i, self.alias[i])
+
+    def tf_sample(self, shape):
+        """То же на операциях TF — для map в tf.data: негативы свежие на каждой эпохе."""
+        import tensorflow as tf
+        i = tf.random.uniform(shape, 0, len(self.prob), dtype=tf.int32)
+        keep = tf.random.uniform(shape) < tf.gather(tf.constant(self.prob), i)
+        return tf.where(keep, i, tf.gather(tf.constant(self.alias), i))
+
+
+def group_by_user(users, items):
+    """Оценки подряд по пользователям (stable — порядок внутри пользователя как в выгрузке)."""
+    order = np.argsort(users, kind='stable')
+    return np.asarray(users)[order], np.asarray(items)[order]
+
+
+def window_pairs(users, items, window=2):
+    """
+    users, items — сгруппированы по пользователю (group_by_user или строки CSR-индекса).
+    (targets, contexts): для каждого смещения d = 1..window пары (seq[i], seq[i-d]) и
+    (seq[i], seq[i+d]) внутри одного пользователя — тот же набор пар, что у цикла по позициям.
+    """
+    targets, contexts = [], []
+    for d in range(1, window + 1):
+        same = users[d:] == users[:-d]
+        left, right = items[:-d][same], items[d:][same]
+        targets += [right, left]
+        contexts += [left, right]
+    if not targets:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    return np.concatenate(targets).astype(np.int32), np.concatenate(contexts).astype(np.int32)
+
+
+def rating_items(ratings, item2idx):
+    """(пользователи factorize-кодами, индексы айтемов) оценок с известными айтемами."""
+    items = ratings.item_id.map(item2idx).to_numpy(dtype=np.float64)
+    known = ~np.isnan(items)
+    return ratings.user_id.factorize()[0][known], items[known].astype(np.int32)
+
+
+def skipgram_pairs(ratings, item2idx, window=2, neg_samples=1, seed=None, sampler=None, rated=None):
+    """
+    ratings: DataFrame с user_id, item_id в порядке выгрузки; rated — уже посчитанный rating_items.
+    (targets, contexts, labels): положительные пары по окну в истории каждого пользователя,
+    за каждой — neg_samples отрицательных с тем же target из sampler
+    (по умолчанию UnigramSampler по частотам этих же оценок).
+    """
+    rng = np.random.default_rng(seed)
+    users, items = rated if rated is not None else rating_items(ratings, item2idx)
+    t, c = window_pairs(*group_by_user(users, items), window)
+    order = rng.permutation(len(t))  # shuffle-буфер tf.data перемешивает только локально
+    t, c = t[order], c[order]
+    sampler = sampler or UnigramSampler.from_items(items, len(item2idx))
+    neg = sampler.sample((len(t), neg_samples), rng)
+    targets = np.repeat(t, neg_samples + 1)
+    contexts = np.column_stack([c, neg]).ravel()
+    labels = np.tile(np.array([1] + [0] * neg_samples, dtype=np.float32), len(t))
+    return targets, contexts, labels
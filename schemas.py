@@ -1,8 +1,50 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
 
-class UserRequest(BaseModel):
+class FusionParams(BaseModel):
+    # None — значения из Settings (и тогда можно отдать предпосчитанный top-K)
+    weights: Optional[Dict[Literal['collab', 'content', 'cross'], float]] = None
+    fusion: Optional[Literal['rrf', 'score']] = None
+
+class UserRequest(FusionParams):
     user_id: int
+    top_k: int = Field(10, ge=1, le=1000)
 
 class RecommendationResponse(BaseModel):
     recommendations: List[int]
+
+class ItemRating(BaseModel):
+    item_id: int
+    rating: float
+
+class RatingsRequest(BaseModel):
+    user_id: int
+    ratings: List[ItemRating]
+
+class FoldInResponse(BaseModel):
+    user_id: int
+    accepted: int
+    new_user: bool
+    took_ms: float
+
+class Event(BaseModel):
+    domain: Literal['books', 'movies']
+    user_id: int
+    item_id: int
+    kind: Literal['rating', 'favourite'] = 'rating'
+    rating: Optional[float] = None   # для favourite не нужен
+    timestamp: Optional[float] = None
+
+class EventsRequest(BaseModel):
+    events: List[Event]
+
+class EventsResponse(BaseModel):
+    accepted: int
+    last_seq: Optional[int]
+
+class BatchUserRequest(FusionParams):
+    user_ids: List[int]
+    top_k: int = Field(10, ge=1, le=1000)
+
+class BatchRecommendationResponse(BaseModel):
+    recommendations: Dict[int, List[int]]
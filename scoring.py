@@ -0,0 +1,209 @@
+import numpy as np
+
+# NumPy-скоринг для сервинга: Keras нужен только для обучения
+
+
+def extract_collab_tables(model):
+    """Достаём из модели build_collab_model таблицы эмбеддингов пользователей и айтемов."""
+    user_mat = model.get_layer('user_embedding').get_weights()[0]
+    item_mat = model.get_layer('item_embedding').get_weights()[0]
+    return (np.ascontiguousarray(user_mat, dtype=np.float32),
+            np.ascontiguousarray(item_mat, dtype=np.float32))
+
+
+class CollabScorer:
+    def __init__(self, user_mat, item_mat):
+        self.user_mat = user_mat
+        self.item_mat = item_mat
+        # uid -> строка после fold-in; user_mat (в mmap-режиме read-only) не трогаем
+        self.overlay = {}
+
+    @property
+    def num_items(self):
+        return self.item_mat.shape[0]
+
+    def merged_users(self, num_users=0):
+        """user_mat с overlay внутри и строками новых пользователей — для снапшота."""
+        overlay = dict(self.overlay)
+        num_users = max(num_users, len(self.user_mat), max(overlay, default=-1) + 1)
+        if not overlay and num_users == len(self.user_mat):
+            return self.user_mat
+        mat = np.zeros((num_users, self.user_mat.shape[1]), dtype=np.float32)
+        mat[:len(self.user_mat)] = self.user_mat
+        for uid, row in overlay.items():
+            mat[uid] = row
+        return mat
+
+    def user_row(self, uid):
+        row = self.overlay.get(uid)
+        return self.user_mat[uid] if row is None else row
+
+    def user_rows(self, uids):
+        if not self.overlay:
+            return self.user_mat[uids]
+        uids = np.asarray(uids)
+        # новые пользователи лежат за пределами user_mat — их строки целиком из overlay
+        rows = self.user_mat[np.minimum(uids, len(self.user_mat) - 1)]
+        for j, uid in enumerate(uids.tolist()):
+            row = self.overlay.get(uid)
+            if row is not None:
+                rows[j] = row
+        return rows
+
+    def score(self, uid):
+        # то же самое, что Dot(axes=1) в модели, но сразу по всем айтемам
+        return self.user_row(uid) @ self.item_mat.T
+
+    def score_items(self, uid, items):
+        # точный пересчёт только для shortlist'а (например, кандидатов из IVF-PQ)
+        return self.item_mat[items] @ self.user_row(uid)
+
+    def score_batch(self, uids):
+        # блок пользователей -> одна матрица-на-матрицу вместо len(uids) матвеков
+        return self.user_rows(uids) @ self.item_mat.T
+
+    def fold_in(self, uid, items, ratings, reg=0.1):
+        """
+        Строка пользователя по его оценкам при фиксированной item-матрице:
+        ridge (VᵀV + λI) u = Vᵀ r — система dim × dim, остальные пользователи не меняются.
+        """
+        v = np.asarray(self.item_mat[items], dtype=np.float32)
+        a = v.T @ v + reg * np.eye(v.shape[1], dtype=np.float32)
+        row = np.linalg.solve(a, v.T @ np.asarray(ratings, dtype=np.float32)).astype(np.float32)
+        self.overlay[uid] = row
+        return row
+
+
+class ContentScorer:
+    """
+    Контентный скоринг без нейросети в запросе.
+    quality — оценка, которую content-модель предсказывает по жанрам каждого айтема;
+    считается один раз при загрузке. В запросе к ней добавляется косинусная близость
+    жанров айтема к жанровому профилю пользователя.
+    """
+    def __init__(self, mat, norms, quality, weight=0.3):
+        self.mat = mat          # items × genres (b_mat / m_mat)
+        self.norms = norms      # L2-нормы строк mat, 0 заменены на 1
+        self.quality = quality  # предсказания модели, отмасштабированные в [0, 1]
+        self.weight = weight
+
+    @classmethod
+    def from_predictions(cls, mat, preds, weight=0.3):
+        preds = np.asarray(preds, dtype=np.float32).ravel()
+        span = float(preds.max() - preds.min()) if len(preds) else 0.0
+        quality = (preds - preds.min()) / span if span > 0 else np.zeros_like(preds)
+        norms = np.linalg.norm(mat, axis=1).astype(np.float32)
+        norms[norms == 0] = 1.0
+        return cls(mat, norms, quality.astype(np.float32), weight)
+
+    def profiles(self, histories):
+        """Нормированные жанровые профили (по строке на историю)."""
+        prof = np.stack([self.mat[h].mean(axis=0) for h in histories]).astype(np.float32)
+        n = np.linalg.norm(prof, axis=1, keepdims=True)
+        return prof / np.where(n == 0, 1.0, n)
+
+    def score_profiles(self, profiles):
+        sims = (profiles @ self.mat.T) / self.norms
+        return sims + self.weight * self.quality
+
+    def score(self, history):
+        return self.score_profiles(self.profiles([history]))[0]
+
+
+class DenseTranslator:
+    """models.translator.Translator (Dense relu -> Dense) на NumPy: веса снимаются с обученной модели."""
+    WEIGHTS = ('w1', 'b1', 'w2', 'b2')
+
+    def __init__(self, w1, b1, w2, b2):
+        self.w1, self.b1, self.w2, self.b2 = w1, b1, w2, b2
+
+    @classmethod
+    def from_keras(cls, model):
+        (w1, b1), (w2, b2) = model.d1.get_weights(), model.d2.get_weights()
+        return cls(*(np.ascontiguousarray(w, dtype=np.float32) for w in (w1, b1, w2, b2)))
+
+    def weights(self):
+        return dict(zip(self.WEIGHTS, (self.w1, self.b1, self.w2, self.b2)))
+
+    def __call__(self, x):
+        hidden = np.maximum(np.asarray(x, dtype=np.float32) @ self.w1 + self.b1, 0.0)
+        return hidden @ self.w2 + self.b2
+
+
+def l2_normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    n = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(n == 0, 1.0, n)
+
+
+class CrossTable:
+    """
+    Переводчик, заранее прогнанный по всем айтемам источника (RECS_CROSS_MODE=table).
+    rows — translator(src_embs), targets — эмбеддинги целевого домена; обе таблицы L2-нормированы,
+    поэтому скалярное произведение с targets — косинус.
+
+    Ранжирование отличается от режима translate, где запрос — translator(mean(src)) и скор —
+    сырое скалярное произведение: здесь среднее берётся после перевода (relu нелинеен, так что
+    это не то же самое), каждая строка вносит вклад по оценке пользователя, а нормировка
+    убирает преимущество целевых айтемов с большой нормой эмбеддинга.
+    """
+    def __init__(self, rows, targets):
+        self.rows = rows
+        self.targets = targets
+
+    @classmethod
+    def build(cls, translator, src_embs, tgt_embs, block=65536):
+        rows = [np.asarray(translator(src_embs[s:s + block])) for s in range(0, len(src_embs), block)]
+        return cls(l2_normalize(np.concatenate(rows)), l2_normalize(tgt_embs))
+
+    def queries(self, histories, weights=None):
+        """Нормированные запросы: среднее строк истории с весами-оценками (None — простое среднее)."""
+        weights = weights if weights is not None else [None] * len(histories)
+        q = []
+        for items, w in zip(histories, weights):
+            if w is None or float(np.sum(w)) <= 0:
+                q.append(self.rows[items].mean(axis=0))
+            else:
+                q.append(np.asarray(w, dtype=np.float32) @ self.rows[items] / float(np.sum(w)))
+        return l2_normalize(np.stack(q))
+
+
+def select_top_k(scores, k, exclude=None):
+    """
+    k лучших по убыванию скора через argpartition + сортировку только победителей.
+    exclude: булева маска или индексы айтемов, которые не надо рекомендовать (уже видел).
+    Возвращает (индексы, скоры).
+    """
+    if exclude is not None and len(exclude):
+        scores = np.array(scores, dtype=np.float32, copy=True)
+        scores[exclude] = -np.inf
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    part = np.argpartition(scores, n - k)[n - k:] if k < n else np.arange(n)
+    idx = part[np.argsort(-scores[part], kind='stable')]
+    top_scores = scores[idx]
+    keep = top_scores > -np.inf
+    return idx[keep], top_scores[keep]
+
+
+def select_top_k_rows(scores, k, exclude=None):
+    """
+    Построчный select_top_k для блока (users × items).
+    exclude: список массивов индексов по строкам; scores при этом меняется на месте.
+    Исключённые позиции возвращаются со скором -inf — их отбрасывает вызывающий.
+    """
+    if exclude is not None:
+        cols = [np.asarray(e, dtype=np.int64) for e in exclude]
+        rows = np.repeat(np.arange(len(cols)), [len(c) for c in cols])
+        if len(rows):
+            scores[rows, np.concatenate(cols)] = -np.inf
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((len(scores), 0), dtype=np.int64), np.empty((len(scores), 0), dtype=scores.dtype)
+    part = np.argpartition(scores, n - k, axis=1)[:, n - k:] if k < n else np.tile(np.arange(n), (len(scores), 1))
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
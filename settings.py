@@ -0,0 +1,69 @@
+import os
+
+
+def _weights(raw):
+    # 'collab=1,content=0.5,cross=1' -> {'collab': 1.0, 'content': 0.5, 'cross': 1.0}
+    pairs = (part.split('=', 1) for part in raw.split(',') if '=' in part)
+    return {k.strip(): float(v) for k, v in pairs}
+
+
+# Настройки сервиса рекомендаций (FastAPI), по аналогии с config.Config у сайта
+
+class Settings:
+    # Считать collab / content / cross параллельно в пуле потоков приложения
+    PARALLEL_SOURCES = os.environ.get('RECS_PARALLEL_SOURCES', '1') == '1'
+    RECS_THREADS = int(os.environ.get('RECS_THREADS') or 8)
+    # Кэш ответов /recommend
+    CACHE_MAX_BYTES = int(os.environ.get('RECS_CACHE_MB') or 64) << 20
+    CACHE_TTL = float(os.environ.get('RECS_CACHE_TTL') or 300)
+    # memory — каждый воркер держит свою копию массивов; mmap — общий read-only снапшот
+    SERVING_MODE = os.environ.get('RECS_SERVING_MODE', 'memory')
+    # HNSW для cross-domain: ef — баланс recall/латентность при поиске
+    CROSS_ANN = os.environ.get('RECS_CROSS_ANN', '1') == '1'
+    HNSW_EF = int(os.environ.get('RECS_HNSW_EF') or 128)
+    # translate — переводчик на каждый запрос по среднему эмбеддингу истории, скор — скалярное произведение;
+    # table — все айтемы переведены при загрузке, запрос — среднее готовых строк с весами-оценками,
+    # скор — косинус (см. scoring.CrossTable о разнице в ранжировании)
+    CROSS_MODE = os.environ.get('RECS_CROSS_MODE', 'translate')
+    # Приближённый collab через IVF-PQ: nprobe списков, shortlist = rerank × top_k с точным пересчётом.
+    # Индекс обучается в /retrain только при включённом флаге. Действует лишь на одиночный /recommend:
+    # /recommend/{domain}/batch, MICROBATCH и офлайн top-K считают collab точно по всей матрице
+    COLLAB_IVF = os.environ.get('RECS_COLLAB_IVF', '0') == '1'
+    IVF_NPROBE = int(os.environ.get('RECS_IVF_NPROBE') or 16)
+    IVF_RERANK = int(os.environ.get('RECS_IVF_RERANK') or 10)
+    # Склейка конкурентных /recommend в батч: до MICROBATCH_MAX пользователей или MICROBATCH_WAIT_MS;
+    # выигрывает от ~8 одновременных клиентов, на одиночных запросах добавляет ожидание окна
+    MICROBATCH = os.environ.get('RECS_MICROBATCH', '0') == '1'
+    MICROBATCH_MAX = int(os.environ.get('RECS_MICROBATCH_MAX') or 64)
+    MICROBATCH_WAIT_MS = float(os.environ.get('RECS_MICROBATCH_WAIT_MS') or 2)
+    # Вес предсказанной content-моделью оценки айтема рядом с близостью к профилю пользователя
+    CONTENT_QUALITY_WEIGHT = float(os.environ.get('RECS_CONTENT_QUALITY_WEIGHT') or 0.3)
+    # Слияние источников: rrf — по рангам, score — по min-max нормированным скорам; веса по источникам
+    FUSION_METHOD = os.environ.get('RECS_FUSION', 'rrf')
+    FUSION_RRF_K = int(os.environ.get('RECS_FUSION_RRF_K') or 60)
+    FUSION_WEIGHTS = _weights(os.environ.get('RECS_FUSION_WEIGHTS', ''))
+    # Fold-in новых оценок без переобучения: регуляризация ridge для строки пользователя
+    FOLD_IN_REG = float(os.environ.get('RECS_FOLD_IN_REG') or 0.1)
+    # Журнал /events: размер сегмента, fsync на каждую пачку, как часто подтягивать хвост и компактить
+    EVENTS_SEGMENT = int(os.environ.get('RECS_EVENTS_SEGMENT') or 100_000)
+    EVENTS_FSYNC = os.environ.get('RECS_EVENTS_FSYNC', '0') == '1'
+    EVENTS_POLL_S = float(os.environ.get('RECS_EVENTS_POLL_S') or 1)
+    EVENTS_COMPACT_S = float(os.environ.get('RECS_EVENTS_COMPACT_S') or 300)  # и новая версия снапшота с событиями
+    # Добавление в избранное = максимальная оценка на сайте
+    FAVOURITE_RATING = float(os.environ.get('RECS_FAVOURITE_RATING') or 10)
+    # Популярное для пользователей без истории: какой список отдавать (trending | global),
+    # период полураспада тренда по timestamp оценок и длина хранимых списков
+    COLD_START_LIST = os.environ.get('RECS_COLD_START_LIST', 'trending')
+    POPULAR_HALF_LIFE_DAYS = float(os.environ.get('RECS_POPULAR_HALF_LIFE_DAYS') or 7)
+    POPULAR_LIST_SIZE = int(os.environ.get('RECS_POPULAR_LIST_SIZE') or 100)
+    # Офлайн top-K для всех пользователей после /retrain
+    PRECOMPUTE_TOPK = os.environ.get('RECS_PRECOMPUTE_TOPK', '1') == '1'
+    PRECOMPUTE_WORKERS = int(os.environ.get('RECS_PRECOMPUTE_WORKERS') or 0) or None
+    # /retrain: процессы для независимых стадий обучения (1 — последовательно) и потоки TF на процесс
+    # (по умолчанию ядра поровну между процессами)
+    TRAIN_WORKERS = int(os.environ.get('RECS_TRAIN_WORKERS') or 2)
+    TRAIN_THREADS = int(os.environ.get('RECS_TRAIN_THREADS') or 0) or None
+    # Skipgram: негативов на положительную пару (unigram^0.75) и сэмплировать ли их в tf.data на лету
+    # вместо материализации всех пар — память только под положительные
+    SKIPGRAM_NEG_SAMPLES = int(os.environ.get('RECS_SKIPGRAM_NEG_SAMPLES') or 1)
+    SKIPGRAM_STREAM = os.environ.get('RECS_SKIPGRAM_STREAM', '0') == '1'
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import tensorflow as tf
+from app.sampling import UnigramSampler, rating_items, skipgram_pairs
 
 # SkipGram for Books and Movies
 
@@ -11,19 +12,29 @@ def load_ratings(path, col):
 def build_mappings(ratings):
     return {itm: i for i, itm in enumerate(ratings.item_id.unique())}
 
-def build_skipgram_dataset(ratings, item2idx, window=2, neg_samples=1, batch_size=64):
-    pairs = []
-    for u in ratings.user_id.unique():
-        seq = ratings[ratings.user_id == u].item_id.map(item2idx).tolist()
-        for idx, target in enumerate(seq):
-            contexts = seq[max(0, idx-window): idx] + seq[idx+1: idx+1+window]
-            for ctx in contexts:
-                pairs.append((target, ctx, 1))
-                for _ in range(neg_samples):
-                    neg = np.random.choice(list(item2idx.values()))
-                    pairs.append((target, neg, 0))
-    arr = np.array(pairs)
-    return tf.data.Dataset.from_tensor_slices((arr[:,0], arr[:,1], arr[:,2])).shuffle(100000).batch(batch_size)
+def build_skipgram_dataset(ratings, item2idx, window=2, neg_samples=1, batch_size=64, stream=False):
+    # stream=False — все пары с негативами заранее в памяти;
+    # stream=True — в памяти только положительные, негативы сэмплируются в map на каждом батче
+    rated = rating_items(ratings, item2idx)  # один проход по оценкам и для сэмплера, и для пар
+    sampler = UnigramSampler.from_items(rated[1], len(item2idx))
+    if not stream:
+        targets, contexts, labels = skipgram_pairs(ratings, item2idx, window, neg_samples, sampler=sampler, rated=rated)
+        return tf.data.Dataset.from_tensor_slices(((targets, contexts), labels)).shuffle(100000).batch(batch_size)
+
+    targets, contexts, _ = skipgram_pairs(ratings, item2idx, window, 0, sampler=sampler, rated=rated)
+    pattern = tf.constant([1.0] + [0.0] * neg_samples)
+
+    def add_negatives(t, c):
+        n = tf.shape(t)[0]
+        neg = sampler.tf_sample((n, neg_samples))
+        pairs = (tf.repeat(t, neg_samples + 1), tf.reshape(tf.concat([c[:, None], neg], 1), [-1]))
+        return pairs, tf.tile(pattern, [n])
+
+    # батч положительных такой, чтобы вместе с негативами вышло ~batch_size примеров
+    return (tf.data.Dataset.from_tensor_slices((targets, contexts)).shuffle(100000)
+            .batch(max(1, batch_size // (neg_samples + 1)))
+            .map(add_negatives, num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE))
 
 def build_skipgram_model(vocab_size, embedding_dim=64):
     in_t = tf.keras.Input(shape=(), name='target')
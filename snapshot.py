@@ -0,0 +1,98 @@
+import os
+import shutil
+import numpy as np
+
+# Снапшот всех плотных массивов сервинга в .npy: воркеры открывают его через mmap
+# только на чтение, и страницы делятся между процессами через page cache ОС.
+#
+# outputs/serving/<version>/*.npy   — сами массивы
+# outputs/serving/CURRENT           — какая версия актуальна (пишется атомарно)
+#
+# Хранятся только CURRENT и предыдущая версия: воркеры, ещё не перечитавшие CURRENT, сидят на ней.
+
+CURRENT = 'CURRENT'
+
+
+def _plain(arr):
+    # object-массивы (строковые ID) не мапятся — переводим в фиксированный unicode
+    arr = np.asarray(arr)
+    return arr.astype(str) if arr.dtype == object else np.ascontiguousarray(arr)
+
+
+def write_snapshot(root, version, arrays):
+    """arrays: {имя: ndarray}. Возвращает путь к каталогу версии."""
+    path = os.path.join(root, version)
+    os.makedirs(path, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(os.path.join(path, f'{name}.npy'), _plain(arr), allow_pickle=False)
+    previous = current_version(root)
+    tmp = os.path.join(root, f'{CURRENT}.{os.getpid()}')
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(root, CURRENT))
+    prune_snapshots(root, keep=(version, previous))
+    return path
+
+
+def prune_snapshots(root, keep):
+    """Удаляет каталоги версий не из keep; уже замапленные файлы живут, пока их держит процесс."""
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name not in keep and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def current_version(root):
+    try:
+        with open(os.path.join(root, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_snapshot(root, version=None, mmap=True):
+    """{имя: ndarray}; при mmap=True массивы read-only и лежат в page cache."""
+    version = version or current_version(root)
+    if version is None:
+        return None, {}
+    path = os.path.join(root, version)
+    arrays = {}
+    for fname in os.listdir(path):
+        if fname.endswith('.npy'):
+            arrays[fname[:-4]] = np.load(os.path.join(path, fname), mmap_mode='r' if mmap else None,
+                                         allow_pickle=False)
+    return version, arrays
+
+
+class TopKStore:
+    """Предпосчитанные top-K по индексу пользователя (см. app.precompute)."""
+    def __init__(self, offsets, items, top_k):
+        self.offsets = offsets
+        self.items = items
+        self.top_k = top_k
+
+    def get(self, uidx):
+        return self.items[self.offsets[uidx]:self.offsets[uidx + 1]].tolist()
+
+    @classmethod
+    def from_arrays(cls, arrays, domain):
+        k = arrays.get(f'topk_{domain}_k')
+        if k is None:
+            return None
+        return cls(arrays[f'topk_{domain}_offsets'], arrays[f'topk_{domain}_items'], int(k[0]))
+
+
+def memory_usage():
+    """RSS и PSS текущего процесса в байтах (PSS делит общие страницы между процессами)."""
+    usage = {}
+    for fname, fields in [('/proc/self/status', ('VmRSS', 'RssFile', 'RssShmem')),
+                          ('/proc/self/smaps_rollup', ('Pss',))]:
+        try:
+            with open(fname) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in fields:
+                        usage[key.lower()] = int(value.split()[0]) * 1024
+        except OSError:
+            pass
+    return usage
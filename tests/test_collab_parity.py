@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from models.collaborative import build_collab_model
+from app.scoring import CollabScorer, extract_collab_tables
+
+
+def test_collab_scorer_matches_model_predict():
+    # сервинг на NumPy должен ранжировать ровно как Keras-модель, из которой взяты веса
+    rng = np.random.default_rng(0)
+    num_users, num_items, dim = 7, 50, 16
+    model = build_collab_model(num_users, num_items, embedding_dim=dim)
+    model.get_layer('user_embedding').set_weights([rng.normal(size=(num_users, dim)).astype(np.float32)])
+    model.get_layer('item_embedding').set_weights([rng.normal(size=(num_items, dim)).astype(np.float32)])
+
+    scorer = CollabScorer(*extract_collab_tables(model))
+    items = np.arange(num_items)
+    for uid in range(num_users):
+        expected = model.predict([np.full(num_items, uid), items], verbose=0).ravel()
+        np.testing.assert_allclose(scorer.score(uid), expected, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(scorer.score_batch(np.arange(num_users))[3], scorer.score(3), rtol=1e-5, atol=1e-5)
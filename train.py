@@ -1,69 +1,237 @@
+import json
 import os
+import pickle
+import shutil
+import time
+import multiprocessing as mp
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 import numpy as np
-import pandas as pd
-from models import collaborative, content, skipgram, translator
+from models import collaborative, content, translator
 from models.skipgram import build_skipgram_dataset, build_skipgram_model
 import tensorflow as tf
+from app.ann import build_hnsw_index, hnsw_path
+from app.columnar import export_csvs, is_fresh
+from app.ivfpq import IVFPQIndex
+from app.preprocess import PREPARED, prepare, save_prepared
+from app.scoring import extract_collab_tables, l2_normalize
+from app.settings import Settings
 
-def train_all_models(data_dir='data', out_dir='outputs'):
+# Обучение как DAG стадий: книжный и киношный пайплайны ничего не делят до переводчиков,
+# поэтому независимые стадии идут в отдельных процессах, каждый со своим бюджетом потоков TF.
+#
+#   preprocess ─┬─ collab_book ── ivfpq_book          ┌─ book2movie
+#               ├─ content_book                       │
+#               ├─ skipgram_book ─┬─ hnsw_book        │
+#               │                 └───────────────────┤
+#               ├─ (то же для movie) ─────────────────┴─ movie2book
+#
+# ivfpq_* — только при RECS_COLLAB_IVF. preprocess выполняется в родителе, его результат по доменам кладётся в <out_dir>/.prepared,
+# и воркеры читают его один раз на процесс. После успешного обучения он становится <out_dir>/prepared —
+# индексами и watermark журнала, на которых обучены веса, для ModelLoader.load_all.
+# Таймлайн стадий — в <out_dir>/train_report.json.
+
+_prepared_dir = None
+_data = {}  # домен -> подготовленные данные (app.preprocess), кэш на процесс
+
+
+def _prepared(domain):
+    if domain not in _data:
+        with open(os.path.join(_prepared_dir, f'{domain}.pkl'), 'rb') as f:
+            _data[domain] = pickle.load(f)
+    return _data[domain]
+
+
+def _collab(out_dir, domain, name):
+    d = _prepared(domain)
+    ds = collaborative.make_collab_dataset(d.ratings, d.user2idx, d.item2idx, d.item_col)
+    model = collaborative.build_collab_model(len(d.user2idx), len(d.item2idx))
+    model.fit(ds, epochs=5)
+    model.save_weights(f"{out_dir}/collab_{name}_weights.h5")
+    # индекс от прежних весов больше не годится; без RECS_COLLAB_IVF новый не строится
+    if os.path.isfile(f"{out_dir}/collab_{name}_ivfpq.npz"):
+        os.remove(f"{out_dir}/collab_{name}_ivfpq.npz")
+
+
+def _ivfpq(out_dir, domain, name):
+    # IVF-PQ над item-эмбеддингами collab, сохраняется рядом с весами
+    d = _prepared(domain)
+    model = collaborative.build_collab_model(len(d.user2idx), len(d.item2idx))
+    model.load_weights(f"{out_dir}/collab_{name}_weights.h5")
+    _, item_mat = extract_collab_tables(model)
+    IVFPQIndex.train(item_mat).save(f"{out_dir}/collab_{name}_ivfpq.npz")
+
+
+def _content(out_dir, domain, name):
+    d = _prepared(domain)
+    ds = content.make_content_dataset(d.genre_mat, d.ratings, d.item2idx, d.item_col)
+    model = content.build_content_model(d.genre_mat.shape[1])
+    model.fit(ds, epochs=5)
+    model.save_weights(f"{out_dir}/content_{name}_weights.h5")
+
+
+def _skipgram(out_dir, domain, name):
+    # на тех же индексах айтемов: строка эмбеддинга = b2idx / m2idx
+    d = _prepared(domain)
+    ds = build_skipgram_dataset(d.ratings.rename(columns={d.item_col: 'item_id'}), d.item2idx,
+                                neg_samples=Settings.SKIPGRAM_NEG_SAMPLES, stream=Settings.SKIPGRAM_STREAM)
+    model = build_skipgram_model(len(d.item2idx))
+    model.fit(ds, epochs=5)
+    np.save(f"{out_dir}/{name}_embeddings.npy", model.get_layer('embedding').get_weights()[0])
+
+
+def _translator(out_dir, src, tgt):
+    src_embs = np.load(f"{out_dir}/{src}_embeddings.npy")
+    tgt_embs = np.load(f"{out_dir}/{tgt}_embeddings.npy")
+    model = translator.Translator(src_embs.shape[1])
+    model.compile(optimizer='adam', loss='mse')
+    model.fit(src_embs, tgt_embs, epochs=5, batch_size=64)
+    model.save_weights(f"{out_dir}/{src}2{tgt}_weights.h5")
+
+
+def _hnsw(out_dir, name):
+    # HNSW-индекс для cross-domain поиска, рядом с эмбеддингами
+    embs = np.load(f"{out_dir}/{name}_embeddings.npy")
+    build_hnsw_index(embs, hnsw_path(out_dir, name))
+    # RECS_CROSS_MODE=table ищет по нормированным целям (CrossTable.targets) — свой индекс;
+    # в режиме translate старый просто удаляем, чтобы не остался от прежних эмбеддингов
+    unit = hnsw_path(out_dir, f'{name}_unit')
+    if Settings.CROSS_MODE == 'table':
+        build_hnsw_index(l2_normalize(embs), unit)
+    else:
+        for path in (unit, f'{unit}.fingerprint'):
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+# стадия -> (зависимости, функция, аргументы после out_dir); порядок ключей — топологический
+DAG = {'preprocess': ((), None, ())}
+for _domain, _name in [('books', 'book'), ('movies', 'movie')]:
+    DAG.update({
+        f'collab_{_name}': (('preprocess',), _collab, (_domain, _name)),
+        f'content_{_name}': (('preprocess',), _content, (_domain, _name)),
+        f'skipgram_{_name}': (('preprocess',), _skipgram, (_domain, _name)),
+        f'hnsw_{_name}': ((f'skipgram_{_name}',), _hnsw, (_name,)),
+    })
+    if Settings.COLLAB_IVF:  # k-means на NumPy — десятки секунд, не платим за него без IVF в сервинге
+        DAG[f'ivfpq_{_name}'] = ((f'collab_{_name}',), _ivfpq, (_domain, _name))
+DAG['book2movie'] = (('skipgram_book', 'skipgram_movie'), _translator, ('book', 'movie'))
+DAG['movie2book'] = (('skipgram_book', 'skipgram_movie'), _translator, ('movie', 'book'))
+
+STAGES = list(DAG)
+
+
+def _peak_rss_mb():
+    # VmHWM — пик RSS процесса; None вне Linux
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM')) / 1024
+    except (OSError, StopIteration):
+        return None
+
+
+def _reset_peak_rss():
+    # '5' в clear_refs сбрасывает VmHWM до текущего RSS — пик считается по каждой стадии отдельно
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass  # тогда в отчёте пик с начала процесса
+
+
+def _init_worker(prepared_dir, threads):
+    global _prepared_dir
+    _prepared_dir = prepared_dir
+    # до первой операции TF: потом размер пулов уже не поменять
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(min(2, threads))
+
+
+def _run_stage(stage, out_dir):
+    _, fn, args = DAG[stage]
+    _reset_peak_rss()
+    start = time.time()
+    fn(out_dir, *args)
+    return {'stage': stage, 'pid': os.getpid(), 'start': start, 'end': time.time(),
+            'peak_rss_mb': _peak_rss_mb()}
+
+
+def run_dag(pool, dag, submit, on_done, finished=()):
+    """
+    Запускает стадии dag ({стадия: (зависимости, ...)}), как только готовы их зависимости.
+    submit(pool, stage) -> Future; on_done(stage, результат) — в порядке завершения;
+    finished — стадии, уже выполненные до запуска.
+    """
+    finished = set(finished)
+    pending = {s: v for s, v in dag.items() if s not in finished}
+    running = {}
+    while pending or running:
+        for stage in [s for s, (deps, *_) in pending.items() if finished.issuperset(deps)]:
+            pending.pop(stage)
+            running[submit(pool, stage)] = stage
+        if not running:
+            raise ValueError(f"unsatisfiable stage dependencies: {sorted(pending)}")
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for fut in done:
+            stage = running.pop(fut)
+            on_done(stage, fut.result())
+            finished.add(stage)
+
+
+def train_all_models(data_dir='data', out_dir='outputs', progress=None, workers=None, threads=None):
+    """
+    progress(stage, done, total) вызывается после каждой стадии.
+    workers — процессы для независимых стадий (1 — по очереди в этом процессе), threads — потоки TF
+    на процесс. Таймлайн стадий (pid, старт/конец от начала, пик памяти) — в <out_dir>/train_report.json.
+    """
+    workers = workers or Settings.TRAIN_WORKERS
+    threads = threads or Settings.TRAIN_THREADS or max(1, (os.cpu_count() or 1) // workers)
     os.makedirs(out_dir, exist_ok=True)
+    t0 = time.time()
+    timeline = []
+
+    def report(stage, entry):
+        timeline.append(dict(entry, start=round(entry['start'] - t0, 3), end=round(entry['end'] - t0, 3),
+                             seconds=round(entry['end'] - entry['start'], 3)))
+        with open(f"{out_dir}/train_report.json", 'w') as f:
+            json.dump({'workers': workers, 'threads': threads, 'wall_seconds': round(time.time() - t0, 3),
+                       'stages': timeline}, f, indent=2)
+        if progress is not None:
+            progress(stage, len(timeline), len(STAGES))
+
+    # Выгрузка читается и нормализуется один раз; индексы общие для всех моделей и для лоадера.
+    # Колоночный снапшот пишется один раз на новую выгрузку — load_all после обучения читает его
+    _reset_peak_rss()
+    start = time.time()
+    if not is_fresh(data_dir):
+        export_csvs(data_dir)
+    data = prepare(data_dir)
+    if data is None:
+        raise FileNotFoundError(f"no ratings export in {data_dir}")
+    prepared_dir = os.path.join(out_dir, '.prepared')
+    save_prepared(data, prepared_dir)
+    if workers == 1:
+        _data.update(books=data.books, movies=data.movies)
+    del data
+    report('preprocess', {'stage': 'preprocess', 'pid': os.getpid(), 'start': start, 'end': time.time(),
+                          'peak_rss_mb': _peak_rss_mb()})
 
-    # Collaborative
-    df_b = collaborative.load_ratings(f"{data_dir}/book_ratings.csv")
-    u2b, b2idx = collaborative.build_mappings(df_b, 'book_id')
-    ds_b = collaborative.make_collab_dataset(df_b, u2b, b2idx, 'book_id')
-    model_b = collaborative.build_collab_model(len(u2b), len(b2idx))
-    model_b.fit(ds_b, epochs=5)
-    model_b.save_weights(f"{out_dir}/collab_book_weights.h5")
-
-    df_m = collaborative.load_ratings(f"{data_dir}/movie_ratings.csv")
-    u2m, m2idx = collaborative.build_mappings(df_m, 'movie_id')
-    ds_m = collaborative.make_collab_dataset(df_m, u2m, m2idx, 'movie_id')
-    model_m = collaborative.build_collab_model(len(u2m), len(m2idx))
-    model_m.fit(ds_m, epochs=5)
-    model_m.save_weights(f"{out_dir}/collab_movie_weights.h5")
-
-    # Content
-    books = content.load_items(f"{data_dir}/books.csv", 'ID', 'genres')
-    b_mat, _ = content.build_genre_matrix(books, b2idx, 'ID', 'genres')
-    b_ds = content.make_content_dataset(b_mat, df_b, b2idx, 'book_id')
-    cont_b = content.build_content_model(b_mat.shape[1])
-    cont_b.fit(b_ds, epochs=5)
-    cont_b.save_weights(f"{out_dir}/content_book_weights.h5")
-
-    movies = content.load_items(f"{data_dir}/movies.csv", 'ID', 'genres')
-    m_mat, _ = content.build_genre_matrix(movies, m2idx, 'ID', 'genres')
-    m_ds = content.make_content_dataset(m_mat, df_m, m2idx, 'movie_id')
-    cont_m = content.build_content_model(m_mat.shape[1])
-    cont_m.fit(m_ds, epochs=5)
-    cont_m.save_weights(f"{out_dir}/content_movie_weights.h5")
-
-    # SkipGram
-    df_b_sg = skipgram.load_ratings(f"{data_dir}/book_ratings.csv", 'book_id')
-    map_b = skipgram.build_mappings(df_b_sg)
-    ds_sg_b = build_skipgram_dataset(df_b_sg, map_b)
-    sg_b = build_skipgram_model(len(map_b))
-    sg_b.fit(ds_sg_b, epochs=5)
-    np.save(f"{out_dir}/book_embeddings.npy", sg_b.get_layer('embedding').get_weights()[0])
-
-    df_m_sg = skipgram.load_ratings(f"{data_dir}/movie_ratings.csv", 'movie_id')
-    map_m = skipgram.build_mappings(df_m_sg)
-    ds_sg_m = build_skipgram_dataset(df_m_sg, map_m)
-    sg_m = build_skipgram_model(len(map_m))
-    sg_m.fit(ds_sg_m, epochs=5)
-    np.save(f"{out_dir}/movie_embeddings.npy", sg_m.get_layer('embedding').get_weights()[0])
-
-    # Translator
-    book_embs = np.load(f"{out_dir}/book_embeddings.npy")
-    movie_embs = np.load(f"{out_dir}/movie_embeddings.npy")
-    dim = book_embs.shape[1]
-
-    b2m = translator.Translator(dim)
-    b2m.compile(optimizer='adam', loss='mse')
-    b2m.fit(book_embs, movie_embs, epochs=5, batch_size=64)
-    b2m.save_weights(f"{out_dir}/book2movie_weights.h5")
-
-    m2b = translator.Translator(dim)
-    m2b.compile(optimizer='adam', loss='mse')
-    m2b.fit(movie_embs, book_embs, epochs=5, batch_size=64)
-    m2b.save_weights(f"{out_dir}/movie2book_weights.h5")
+    try:
+        if workers > 1:
+            # spawn, а не fork: родитель (сервис после /retrain) может держать инициализированный TF
+            pool = ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(prepared_dir, threads))
+        else:
+            pool = ThreadPoolExecutor(1)
+        with pool:
+            try:
+                run_dag(pool, DAG, lambda p, stage: p.submit(_run_stage, stage, out_dir), report,
+                        finished=['preprocess'])
+            except BaseException:
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+        shutil.rmtree(os.path.join(out_dir, PREPARED), ignore_errors=True)
+        os.replace(prepared_dir, os.path.join(out_dir, PREPARED))
+    finally:
+        _data.clear()
+        shutil.rmtree(prepared_dir, ignore_errors=True)